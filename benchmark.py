@@ -0,0 +1,451 @@
+"""Benchmark of the processing engine against a local stand-in of the YouTube api, no quota is spent
+
+A fake youtube/v3/channels endpoint answers with synthetic channels after a configurable latency, and fails a part
+of the requests with transient errors or quotaExceeded. Synthetic workbooks of the requested sizes are processed one
+after the other, each in its own process so the peak memory of a size is not hidden by the previous ones.
+
+Typical use:
+    python benchmark.py --sizes 1000,10000 --latency 50 --error-rate 0.01 --output benchmark.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import collections
+import multiprocessing
+import concurrent.futures
+
+import openpyxl
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import engine
+
+try:
+    import resource
+except ImportError:  # not available on Windows, the peak memory is not reported
+    resource = None
+
+# number of rows of the synthetic workbooks processed by default
+DEFAULT_SIZES = (1000, 10000, 100000)
+# share of the rows repeating an url of a previous row
+DUPLICATE_RATE = 0.1
+# share of the rows given as an @handle url instead of a /channel/ url
+HANDLE_RATE = 0.1
+# share of the channels missing from the api responses
+MISSING_RATE = 0.02
+# characters of the channel ids after the UC prefix
+CHANNEL_ID_CHARACTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_-"
+# topic ids given to the synthetic channels, with an id missing from the taxonomy
+SYNTHETIC_TOPIC_IDS = [*engine.TOPIC_LABELS, "/m/0unknown"]
+# sentences the synthetic descriptions are made of, in several languages
+SYNTHETIC_SENTENCES = [
+    "Welcome to my channel, new videos every week about cooking and travel.",
+    "Subscribe for daily gaming highlights and live streams with the community.",
+    "Bienvenue sur ma chaîne, je publie des vidéos de musique tous les vendredis.",
+    "Abonnez-vous pour ne rater aucune recette de cuisine facile et rapide.",
+    "Willkommen auf meinem Kanal, hier gibt es jede Woche neue Technikvideos.",
+    "Bienvenidos a mi canal, aquí encontrarás tutoriales de maquillaje y moda.",
+    "Benvenuti sul mio canale, ogni settimana nuovi video di calcio e sport.",
+    "Bem-vindos ao meu canal, vídeos novos de humor todas as semanas.",
+    "Добро пожаловать на мой канал, здесь вы найдёте обзоры игр и новостей.",
+    "私のチャンネルへようこそ、毎週新しい動画をアップしています。",
+]
+
+
+def make_channel_id(seed):
+    """Get a valid channel id always the same for a seed
+
+    Parameters
+    ----------
+    seed : str
+        text the channel id is derived from
+    """
+    digest = hashlib.sha256(seed.encode()).digest()
+    return "UC" + "".join(CHANNEL_ID_CHARACTERS[byte % len(CHANNEL_ID_CHARACTERS)] for byte in digest[:22])
+
+
+def make_channel(channel_id, parts):
+    """Get the synthetic resource of a channel always the same for a channel id, None if the channel is missing
+
+    Parameters
+    ----------
+    channel_id : str
+        id of the channel
+    parts : set
+        parts of the resource requested
+    """
+    rng = random.Random(channel_id)
+    if rng.random() < MISSING_RATE:
+        return None
+
+    channel = {"id": channel_id}
+    if "status" in parts:
+        channel["status"] = {"madeForKids": rng.random() < 0.2}
+    if "snippet" in parts:
+        channel["snippet"] = {"description": " ".join([rng.choice(SYNTHETIC_SENTENCES)] * rng.randint(1, 6))}
+    if "topicDetails" in parts:
+        channel["topicDetails"] = {"topicIds": rng.sample(SYNTHETIC_TOPIC_IDS, rng.randint(1, 3))}
+    return channel
+
+
+class FakeYouTubeApi(ThreadingHTTPServer):
+    """Local stand-in of the youtube/v3/channels endpoint
+
+    Requests by id get synthetic channels, requests by handle or username get an id derived from the name.
+    Each request waits for the latency, then fails with a backendError or a quotaExceeded at the given rates. A token
+    that got a quotaExceeded keeps getting it, like a real token out of quota.
+
+    Methods
+    -------
+    start()
+        serve the requests in a background thread
+    reset()
+        clear the counters and the exhausted tokens
+    """
+    daemon_threads = True
+
+    def __init__(self, latency=0.05, error_rate=0.0, quota_rate=0.0, seed=0):
+        """
+        Parameters
+        ----------
+        latency : float
+            average number of seconds before a response, each request waits between half and 1.5 times of it
+        error_rate : float
+            share of the requests failing with a transient backendError
+        quota_rate : float
+            share of the requests failing with quotaExceeded
+        seed : int
+            seed of the random failures
+        """
+        super().__init__(("127.0.0.1", 0), FakeYouTubeApiHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.exhausted_keys = set()
+
+    @property
+    def api_endpoint(self):
+        """Root url of the stand-in, to set in YOUTUBE_API_ENDPOINT"""
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/"
+
+    def start(self):
+        """Serve the requests in a background thread"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def reset(self):
+        """Clear the counters and the exhausted tokens"""
+        with self.lock:
+            self.counters.clear()
+            self.exhausted_keys.clear()
+
+    def draw_failure(self, api_key):
+        """Choose the failure of a request, None when the request succeeds
+
+        Parameters
+        ----------
+        api_key : str
+            token of the request
+        """
+        with self.lock:
+            self.counters["requests"] += 1
+            draw = self.rng.random()
+            if api_key in self.exhausted_keys or draw < self.quota_rate:
+                self.exhausted_keys.add(api_key)
+                self.counters["quota_errors"] += 1
+                return 403, "quotaExceeded"
+            if draw < self.quota_rate + self.error_rate:
+                self.counters["transient_errors"] += 1
+                return 503, "backendError"
+            return None
+
+
+class FakeYouTubeApiHandler(BaseHTTPRequestHandler):
+    """Answers the requests of FakeYouTubeApi"""
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, Nagle's algorithm would delay every keep-alive response by 40 ms
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        """Answer a channels().list request"""
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if not url.path.endswith("/youtube/v3/channels"):
+            self.send_json(404, {"error": {"code": 404, "message": "Not Found", "errors": [{"reason": "notFound"}]}})
+            return
+
+        time.sleep(self.server.latency * random.uniform(0.5, 1.5))
+
+        failure = self.server.draw_failure(query.get("key"))
+        if failure:
+            status, reason = failure
+            self.send_json(status, {"error": {"code": status, "message": reason,
+                                              "errors": [{"reason": reason, "message": reason}]}})
+            return
+
+        if "id" in query:
+            parts = set(query.get("part", "").split(","))
+            channels = [make_channel(channel_id, parts) for channel_id in query["id"].split(",")]
+            items = [channel for channel in channels if channel]
+        elif "forHandle" in query or "forUsername" in query:
+            name = (query.get("forHandle") or query.get("forUsername")).lstrip("@").lower()
+            items = [{"id": make_channel_id(name)}]
+        else:
+            items = []
+
+        self.send_json(200, {"kind": "youtube#channelListResponse", "items": items})
+
+    def send_json(self, status, body):
+        """Send a json response
+
+        Parameters
+        ----------
+        status : int
+            http status of the response
+        body : dict
+            content of the response
+        """
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        """Don't log the requests"""
+
+
+def make_workbook(path, size, seed=0):
+    """Write a workbook matching the template with synthetic placements
+
+    Parameters
+    ----------
+    path : str
+        path of the Excel file
+    size : int
+        number of rows of the Data tab
+    seed : int
+        seed of the placements
+
+    Returns
+    -------
+    int
+        number of unique urls
+    """
+    rng = random.Random(seed)
+    urls = []
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Data")
+    sheet.append(["Placement", "Placement URL"])
+
+    for i in range(size):
+        # repeat a previous url, or give a new channel by handle or by id
+        if urls and rng.random() < DUPLICATE_RATE:
+            url = rng.choice(urls)
+        elif rng.random() < HANDLE_RATE:
+            url = f"https://www.youtube.com/@channel{seed}x{i}"
+        else:
+            url = f"https://www.youtube.com/channel/{make_channel_id(f'{seed}-{i}')}"
+        urls.append(url)
+        sheet.append([f"Channel {i}", url])
+
+    workbook.save(path)
+    return len(set(urls))
+
+
+def get_peak_memory():
+    """Get the peak resident memory of the process in MB, None when it can't be measured"""
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_benchmark(path, api_endpoint, api_keys, settings):
+    """Process a workbook and measure the run, meant to run in a process of its own
+
+    Parameters
+    ----------
+    path : str
+        path of the Excel file
+    api_endpoint : str
+        root url of the stand-in of the api
+    api_keys : list
+        tokens sent to the stand-in
+    settings : dict
+        keyword arguments of check_channels
+
+    Returns
+    -------
+    dict
+        measures of the run
+    """
+    os.environ[engine.API_ENDPOINT_VARIABLE] = api_endpoint
+    metrics = engine.RunMetrics()
+    first_result = []
+    checked_rows = collections.Counter()
+    start = time.perf_counter()
+
+    channels, processed_channels = engine.load_channels(path, metrics)
+    results_file = engine.ResultsFile(path)
+    quota_scheduler = engine.QuotaScheduler(api_keys)
+
+    def on_progress(count, kind):
+        """Count the rows of the channels fetched or cached and record the time of the first one
+
+        The skipped channels are left for the next run or are urls without channel, written without any check.
+        """
+        if kind == "skipped":
+            return
+        checked_rows[kind] += count
+        if not first_result:
+            first_result.append(time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as cache_directory, open(os.devnull, "w") as devnull:
+        # the engine prints every row, keep the report readable
+        with contextlib.redirect_stdout(devnull):
+            status = engine.check_channels(channels, results_file, quota_scheduler,
+                                           cache_path=os.path.join(cache_directory, "channel_cache.db"),
+                                           on_progress=on_progress, metrics=metrics, **settings)
+        with metrics.measure("save"):
+            results_file.save()
+
+    elapsed = time.perf_counter() - start
+    summary = metrics.summary()
+    stages = collections.defaultdict(lambda: {"total": 0, "p50": None, "p95": None, "p99": None}, summary["stages"])
+
+    return {"urls": len(channels),
+            "unique_channels": engine.count_unique_channels(channels),
+            "status": status,
+            "seconds": round(elapsed, 3),
+            "checked_rows": sum(checked_rows.values()),
+            "cached_rows": checked_rows["cached"],
+            # only the rows checked count, a run stopped by the quota or the errors writes fewer rows than urls
+            "channels_per_second": round(sum(checked_rows.values()) / elapsed, 1),
+            "time_to_first_result": round(first_result[0], 3) if first_result else None,
+            "load_seconds": round(stages["load"]["total"] + stages["template_check"]["total"], 3),
+            "save_seconds": round(stages["save"]["total"], 3),
+            # summed over the threads, it can exceed the duration of the run
+            "network_seconds": round(stages["api"]["total"], 3),
+            "api_latency": {percentile: stages["api"][percentile] for percentile in ("p50", "p95", "p99")},
+            "detection_seconds": round(stages["detection"]["total"], 3),
+            "quota_units": summary["counters"].get("quota_units", 0),
+            "retries": summary["counters"].get("retries", 0),
+            "peak_rss_mb": get_peak_memory()}
+
+
+def parse_arguments(argv=None):
+    """Parses the arguments of the command line
+
+    Parameters
+    ----------
+    argv : list
+        arguments to parse, default to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Measure the throughput of the processing engine against a local "
+                                                 "stand-in of the YouTube api.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="number of rows of the synthetic workbooks, separated by commas (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=50,
+                        help="average latency of the api in milliseconds (default: %(default)s)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="share of the requests failing with a transient error (default: %(default)s)")
+    parser.add_argument("--quota-rate", type=float, default=0.0,
+                        help="share of the requests failing with quotaExceeded (default: %(default)s)")
+    parser.add_argument("--keys", type=int, default=3, help="number of fake tokens (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=engine.DEFAULT_FETCH_WORKERS,
+                        help="number of parallel requests (default: %(default)s)")
+    parser.add_argument("--qps", type=float, default=engine.MAX_REQUESTS_PER_SECOND,
+                        help="maximum number of requests per second (default: %(default)s)")
+    parser.add_argument("--languages", default="",
+                        help="ISO 639-3 codes the language detection is restricted to, e.g. 'eng,fra'")
+    parser.add_argument("--low-accuracy", action="store_true", help="use the faster low accuracy language detection")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data (default: %(default)s)")
+    parser.add_argument("--output", help="json file where the report is written")
+
+    arguments = parser.parse_args(argv)
+
+    try:
+        arguments.sizes = [int(size) for size in arguments.sizes.split(",") if size.strip()]
+        arguments.languages = engine.parse_languages(arguments.languages)
+    except ValueError as e:
+        parser.error(str(e))
+
+    return arguments
+
+
+def main(argv=None):
+    """Runs the benchmark on every size and prints the report
+
+    Parameters
+    ----------
+    argv : list
+        arguments to parse, default to sys.argv
+    """
+    arguments = parse_arguments(argv)
+    api_keys = [f"benchmark-key-{i}" for i in range(arguments.keys)]
+    settings = {"workers": arguments.workers, "requests_per_second": arguments.qps,
+                "languages": arguments.languages, "low_accuracy": arguments.low_accuracy}
+
+    api = FakeYouTubeApi(latency=arguments.latency / 1000, error_rate=arguments.error_rate,
+                         quota_rate=arguments.quota_rate, seed=arguments.seed)
+    api.start()
+
+    report = {"python": platform.python_version(), "platform": platform.platform(),
+              "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "settings": {**settings, "languages": list(arguments.languages), "latency_ms": arguments.latency,
+                           "error_rate": arguments.error_rate, "quota_rate": arguments.quota_rate,
+                           "keys": arguments.keys, "seed": arguments.seed},
+              "runs": []}
+
+    # spawn a fresh process per size, the peak memory of a process never decreases
+    context = multiprocessing.get_context("spawn")
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for size in arguments.sizes:
+                path = os.path.join(directory, f"benchmark_{size}.xlsx")
+                make_workbook(path, size, seed=arguments.seed)
+                api.reset()
+
+                with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    run = executor.submit(run_benchmark, path, api.api_endpoint, api_keys, settings).result()
+                run.update({"rows": size, "requests": api.counters["requests"],
+                            "transient_errors": api.counters["transient_errors"],
+                            "quota_errors": api.counters["quota_errors"]})
+                report["runs"].append(run)
+
+                first_result = "none" if run["time_to_first_result"] is None else f"{run['time_to_first_result']}s"
+                print(f"{size:>7} rows: {run['checked_rows']} checked, {run['channels_per_second']:>8} channels/s, "
+                      f"{run['seconds']}s, first result {first_result}, network {run['network_seconds']}s, "
+                      f"detection {run['detection_seconds']}s, peak {run['peak_rss_mb']} MB, "
+                      f"{run['requests']} requests, status {run['status']}")
+    finally:
+        api.shutdown()
+        api.server_close()
+
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,374 @@
+"""Command line entry point of the YouTube Exclusion List Builder, runs the processing engine without interface
+
+Typical use:
+    YOUTUBE_API_KEYS=key1,key2 python cli.py placements.xlsx --workers 8
+    python cli.py campaign1.xlsx campaign2.xlsx --api-key-file keys.txt --output results/
+    python cli.py exports/ --output results/
+    python cli.py placements.xlsx --report run.json
+    python cli.py placements.xlsx --rules rules.json --exclusions-csv exclusions/
+    python cli.py master.xlsx --refresh 30
+    python cli.py exports/ --no-excel --csv results.csv --parquet results/ --sqlite results.db
+"""
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import argparse
+import datetime
+
+from engine import (DEFAULT_FETCH_WORKERS, MAX_FETCH_WORKERS, DEFAULT_CACHE_TTL_DAYS, DEFAULT_RETRY_BUDGET,
+                    DEFAULT_REFRESH_DAYS, TemplateError, CombinedResultsFile, CsvResultsFile, ParquetResultsFile,
+                    QuotaScheduler, ResultsFile, RunMetrics, SharedResultsFile, SqliteResultsFile, ThroughputEstimator,
+                    check_channels, count_unique_channels, find_invalid_api_keys, find_workbooks, load_channels,
+                    parse_columns, parse_languages)
+from exclusions import build_exclusions, load_rule_sets
+
+# environment variable read for the tokens, separated by commas
+API_KEYS_VARIABLE = "YOUTUBE_API_KEYS"
+# seconds between two progress lines of a run
+PROGRESS_INTERVAL = 10
+
+
+def parse_arguments(argv=None):
+    """Parses the arguments of the command line
+
+    Parameters
+    ----------
+    argv : list
+        arguments to parse, default to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Check the YouTube channels of Google Ads placement exports and "
+                                                 "write their properties in the Results tab of each file.")
+    parser.add_argument("files", nargs="+", help="Excel files matching the template, or folders of Excel files")
+    parser.add_argument("--api-key", action="append", default=[],
+                        help=f"YouTube API token, can be repeated (default to ${API_KEYS_VARIABLE})")
+    parser.add_argument("--api-key-file", help="file with one YouTube API token per line")
+    parser.add_argument("--output", help="output file, or directory when several files are given (default to "
+                                         "write the results in the input files), an existing output is resumed "
+                                         "instead of copying the input over it")
+    parser.add_argument("--workers", type=int, default=DEFAULT_FETCH_WORKERS,
+                        help=f"number of parallel requests, 1 to {MAX_FETCH_WORKERS} (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="don't read the channels from the local cache")
+    parser.add_argument("--cache-ttl", type=int, default=DEFAULT_CACHE_TTL_DAYS,
+                        help="number of days a cached channel is valid (default: %(default)s)")
+    parser.add_argument("--languages", default="",
+                        help="ISO 639-3 codes the language detection is restricted to, e.g. 'eng,fra'")
+    parser.add_argument("--columns", default="madeForKids,description,topic",
+                        help="columns to check, the language is detected with the description (default: %(default)s)")
+    parser.add_argument("--low-accuracy", action="store_true", help="use the faster low accuracy language detection")
+    parser.add_argument("--retry-budget", type=int, default=DEFAULT_RETRY_BUDGET,
+                        help="number of retries of transient api errors allowed for the whole run, shared by all files "
+                             "(default: %(default)s)")
+    parser.add_argument("--refresh", type=int, nargs="?", const=DEFAULT_REFRESH_DAYS, metavar="DAYS",
+                        help="check again the channels of the Results tab checked more than DAYS days ago "
+                             f"(default: {DEFAULT_REFRESH_DAYS}) or with an error or no data, their rows are updated "
+                             "in place")
+    parser.add_argument("--skip-validation", action="store_true", help="don't send a request to validate the tokens")
+    parser.add_argument("--rules", help="json or Excel file with the rule sets of the exclusion lists (default to the "
+                                        "Rules tab of each file, no list is built without rules)")
+    parser.add_argument("--exclusions-csv", help="directory where the exclusion lists are written as csv files")
+    parser.add_argument("--csv", help="csv file where the results of all files are appended as they arrive, a url "
+                                      "checked again by a later run gets a new row")
+    parser.add_argument("--parquet", help="folder where the results of the run are written in a Parquet file, "
+                                          "requires pyarrow, each run adds its own file")
+    parser.add_argument("--sqlite", help="SQLite database where the results are written in the results table, one "
+                                         "row per url replaced when the url is checked again")
+    parser.add_argument("--no-excel", action="store_true", help="don't write the Results tab of the Excel files, the "
+                                                                "results are only written with --csv, --parquet or "
+                                                                "--sqlite and no exclusion list is built, every run "
+                                                                "then processes all the channels of the files again")
+    parser.add_argument("--report", help="file where the timings of the stages, the requests and the cache hits of the "
+                                         "run are written, csv when it ends with .csv, json otherwise")
+
+    arguments = parser.parse_args(argv)
+
+    if not 1 <= arguments.workers <= MAX_FETCH_WORKERS:
+        parser.error(f"--workers must be between 1 and {MAX_FETCH_WORKERS}")
+
+    try:
+        arguments.languages = parse_languages(arguments.languages)
+        arguments.columns = parse_columns(arguments.columns)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if arguments.refresh is not None and arguments.refresh < 0:
+        parser.error("--refresh must be 0 or more")
+
+    if arguments.no_excel and not (arguments.csv or arguments.parquet or arguments.sqlite):
+        parser.error("--no-excel requires --csv, --parquet or --sqlite")
+
+    try:
+        arguments.rule_sets = load_rule_sets(arguments.rules) if arguments.rules else None
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+    arguments.api_keys = read_api_keys(arguments.api_key, arguments.api_key_file)
+    if not arguments.api_keys:
+        parser.error(f"no token given, use --api-key, --api-key-file or ${API_KEYS_VARIABLE}")
+
+    return arguments
+
+
+def read_api_keys(api_keys, api_key_file=None):
+    """Gets the tokens from the arguments, the token file and the environment, duplicates are ignored
+
+    Parameters
+    ----------
+    api_keys : list
+        tokens given with --api-key
+    api_key_file : str
+        path of a file with one token per line
+    """
+    keys = list(api_keys)
+
+    if api_key_file:
+        with open(api_key_file) as file:
+            keys.extend(line.strip() for line in file)
+
+    keys.extend(os.environ.get(API_KEYS_VARIABLE, "").split(","))
+
+    return list(dict.fromkeys(key.strip() for key in keys if key.strip()))
+
+
+def get_output_path(input_path, output, several_files, used_paths=()):
+    """Gets the path of the file where the results of an input file are written
+
+    Parameters
+    ----------
+    input_path : str
+        path of the input file
+    output : str
+        --output argument, None to write in the input file
+    several_files : bool
+        several input files are processed, the output is a directory
+    used_paths : iterable
+        output paths of the files already added to the run, a file of another folder with the same name is numbered
+        instead of overwriting them
+    """
+    if not output:
+        return input_path
+
+    if several_files or os.path.isdir(output):
+        os.makedirs(output, exist_ok=True)
+        output_path = os.path.join(output, os.path.basename(input_path))
+        stem, extension = os.path.splitext(output_path)
+        number = 1
+        while output_path in used_paths:
+            number += 1
+            output_path = f"{stem}_{number}{extension}"
+        return output_path
+
+    return output
+
+
+def get_progress_printer(job_name, throughput_estimator):
+    """Gets the on_progress callback of a run, printing the time left every PROGRESS_INTERVAL seconds
+
+    Parameters
+    ----------
+    job_name : str
+        path of the file or number of files of the run, printed at the start of the lines
+    throughput_estimator : ThroughputEstimator
+        estimator of the channels of the run
+    """
+    last_print = time.monotonic()
+
+    def on_progress(count, kind):
+        """Report the channels done and print the progress when the interval is reached"""
+        nonlocal last_print
+        throughput_estimator.add(count, kind)
+
+        if time.monotonic() - last_print < PROGRESS_INTERVAL:
+            return
+        last_print = time.monotonic()
+        throughput_estimator.sample()
+
+        time_left = throughput_estimator.time_left()
+        projected_quota = throughput_estimator.projected_quota()
+        print(f"{job_name}: {throughput_estimator.channels_left()} channels left, "
+              f"{throughput_estimator.channels_per_second or 0:.1f} channels/s, "
+              f"{'?' if time_left is None else datetime.timedelta(seconds=round(time_left))} left, "
+              f"{'?' if projected_quota is None else projected_quota} quota needed", file=sys.stderr)
+
+    return on_progress
+
+
+def main(argv=None):
+    """Processes the channels of all files in one run with the tokens shared between them
+
+    Parameters
+    ----------
+    argv : list
+        arguments to parse, default to sys.argv
+
+    Returns
+    -------
+    int
+        exit code, 0 when all files are processed, 1 if a file couldn't be processed, 2 when the quota is exhausted,
+        3 when channels were left for the next run after transient errors
+    """
+    arguments = parse_arguments(argv)
+
+    # share the daily quota of all tokens between the files
+    quota_scheduler = QuotaScheduler(arguments.api_keys)
+
+    if not arguments.skip_validation:
+        # the tokens out of quota for today are valid, the run starts with the others
+        invalid_keys = find_invalid_api_keys(arguments.api_keys, quota_scheduler)
+        if invalid_keys:
+            print(f"Token invalid: n°{', '.join(map(str, invalid_keys))}", file=sys.stderr)
+            return 1
+    metrics = RunMetrics()
+    try:
+        results_writers = open_results_writers(arguments)
+    except (ImportError, OSError, ValueError, sqlite3.Error) as e:
+        print(str(e), file=sys.stderr)
+        return 1
+
+    try:
+        return process_files(arguments, quota_scheduler, metrics, results_writers)
+    finally:
+        for results_writer in results_writers:
+            results_writer.close()
+        if arguments.report:
+            metrics.save(arguments.report)
+
+
+def open_results_writers(arguments):
+    """Opens the outputs of the results given with --csv, --parquet and --sqlite
+
+    Parameters
+    ----------
+    arguments : argparse.Namespace
+        parsed arguments of the command line
+
+    Returns
+    -------
+    list
+        CsvResultsFile, ParquetResultsFile and SqliteResultsFile of the outputs given
+    """
+    results_writers = []
+    try:
+        if arguments.csv:
+            results_writers.append(CsvResultsFile(arguments.csv))
+        if arguments.parquet:
+            results_writers.append(ParquetResultsFile(arguments.parquet))
+        if arguments.sqlite:
+            results_writers.append(SqliteResultsFile(arguments.sqlite))
+    except Exception:
+        for results_writer in results_writers:
+            results_writer.close()
+        raise
+
+    return results_writers
+
+
+def process_files(arguments, quota_scheduler, metrics, results_writers=()):
+    """Processes the channels of all files in one run and returns the exit code of the command
+
+    A channel found in several files is fetched once and written in each of them, and once in the other outputs.
+
+    Parameters
+    ----------
+    arguments : argparse.Namespace
+        parsed arguments of the command line
+    quota_scheduler : QuotaScheduler
+        scheduler of the tokens shared by the files
+    metrics : RunMetrics
+        metrics of the whole run
+    results_writers : iterable
+        other outputs of the results, e.g. CsvResultsFile
+    """
+    exit_code = 0
+    input_paths = find_workbooks(arguments.files)
+    shared_results_file = SharedResultsFile()
+
+    for input_path in input_paths:
+        used_paths = [results_file.path for results_file in shared_results_file.results_files]
+        output_path = get_output_path(input_path, arguments.output, len(input_paths) > 1, used_paths)
+        # the output of a file of another folder with the same name was numbered
+        if not arguments.no_excel and get_output_path(input_path, arguments.output, len(input_paths) > 1) in used_paths:
+            print(f"{input_path}: another file has the same name, results written in {output_path}",
+                  file=sys.stderr)
+
+        results_file = ResultsFile(output_path)
+        # the output written by an earlier run, stopped by the quota or killed, is resumed from its Results tab
+        resumed = output_path != input_path and not arguments.no_excel and os.path.exists(output_path)
+
+        try:
+            channels, processed_channels = load_channels(output_path if resumed else input_path, metrics,
+                                                         arguments.refresh)
+        except (TemplateError, OSError) as e:
+            print(f"{output_path if resumed else input_path}: {str(e)}", file=sys.stderr)
+            exit_code = 1
+            continue
+
+        if output_path != input_path and not arguments.no_excel and not resumed:
+            # the journal of a run on an output removed since then would be merged in the copy
+            if os.path.exists(results_file.journal_path):
+                os.remove(results_file.journal_path)
+            shutil.copyfile(input_path, output_path)
+        elif resumed:
+            print(f"{input_path}: resumed from {output_path}", file=sys.stderr)
+
+        channels_to_process = {k: v for k, v in channels.items() if k not in processed_channels}
+        shared_results_file.add(results_file, channels_to_process)
+        print(f"{input_path}: {len(channels_to_process)} channels to process, "
+              f"{count_unique_channels(channels_to_process)} unique", file=sys.stderr)
+
+    if not shared_results_file.results_files:
+        return exit_code or 1
+
+    # the channels of all files, each url once
+    channels_to_process = shared_results_file.channels()
+    job_name = input_paths[0] if len(input_paths) == 1 else f"{len(shared_results_file.results_files)} files"
+    if len(shared_results_file.results_files) > 1:
+        print(f"{job_name}: {len(channels_to_process)} channels to process, "
+              f"{count_unique_channels(channels_to_process)} unique", file=sys.stderr)
+
+    # on a refresh the cache must not give back channels older than the rows checked again
+    cache_ttl = arguments.cache_ttl if arguments.refresh is None else min(arguments.cache_ttl, arguments.refresh)
+    on_progress = get_progress_printer(job_name, ThroughputEstimator(len(channels_to_process)))
+    # the files only give the channels to process when their Results tab is not written
+    results_output = CombinedResultsFile([*([] if arguments.no_excel else [shared_results_file]), *results_writers])
+
+    try:
+        status = check_channels(channels_to_process, results_output, quota_scheduler, workers=arguments.workers,
+                                use_cache=not arguments.no_cache, cache_ttl=cache_ttl,
+                                languages=arguments.languages, low_accuracy=arguments.low_accuracy,
+                                retry_budget=arguments.retry_budget, columns=arguments.columns,
+                                metrics=metrics, on_progress=on_progress)
+    except KeyboardInterrupt:
+        # save the results collected before the interruption
+        results_output.save()
+        print(f"{job_name}: process stopped, result saved", file=sys.stderr)
+        return 130
+
+    with metrics.measure("save"):
+        results_output.save()
+    print(f"{job_name}: process {status}, {quota_scheduler.remaining()} quota left", file=sys.stderr)
+
+    for results_file in [] if arguments.no_excel else shared_results_file.results_files:
+        try:
+            # build the exclusion lists of the rules given or of the Rules tab of the file
+            with metrics.measure("exclusions"):
+                excluded = build_exclusions(results_file.path, arguments.rule_sets, arguments.exclusions_csv)
+        except ValueError as e:
+            print(f"{results_file.path}: {str(e)}", file=sys.stderr)
+            exit_code = 1
+        else:
+            for name, count in excluded.items():
+                print(f"{results_file.path}: {count} channels excluded by {name}", file=sys.stderr)
+
+    if status == "quota":
+        return 2
+    elif status == "retry":
+        # channels failed with transient errors, running the command again processes them
+        exit_code = exit_code or 3
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2339 @@
+"""Processing engine of the YouTube Exclusion List Builder, shared by the interface and the command line
+
+The module has no dependency on tkinter: template check of the Excel file, fetching of the channels properties,
+language detection and writing of the results are done here and report to the caller through return values,
+exceptions and callbacks.
+"""
+import os
+import re
+import csv
+import json
+import math
+import time
+import random
+import socket
+import shutil
+import sqlite3
+import datetime
+import zipfile
+import tempfile
+import openpyxl
+import threading
+import functools
+import contextlib
+import posixpath
+import collections
+import concurrent.futures
+import xml.etree.ElementTree
+
+import httplib2
+
+from urllib.parse import urlparse, unquote
+from xml.sax.saxutils import escape, quoteattr
+from openpyxl.utils import get_column_letter
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from lingua import LanguageDetectorBuilder, IsoCode639_3
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional, only needed to write the results in Parquet files
+    pyarrow = None
+
+# environment variable overriding the root url of the api, used to run against a local stand-in
+API_ENDPOINT_VARIABLE = "YOUTUBE_API_ENDPOINT"
+# maximum number of channel ids accepted by a single channels().list request
+CHANNEL_BATCH_SIZE = 50
+# default and maximum number of threads sending requests at the same time
+DEFAULT_FETCH_WORKERS = 4
+MAX_FETCH_WORKERS = 16
+# requests per second allowed by all threads, stays under the per token limit of the YouTube api
+MAX_REQUESTS_PER_SECOND = 10
+# quota units given per day to a token and cost of a channels().list request
+DAILY_QUOTA_PER_KEY = 10000
+CHANNEL_LIST_COST = 1
+# local cache of the channels properties shared by all runs and default number of days before an entry expires
+CHANNEL_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".youtube_exclusion_list_builder", "channel_cache.db")
+DEFAULT_CACHE_TTL_DAYS = 30
+# the results are written in the journal of the file every time this number of channels or seconds is reached
+CHECKPOINT_CHANNELS = 2000
+CHECKPOINT_INTERVAL = 300
+# suffix of the journal next to the Excel file, one json row per line, merged in the file when the run is saved
+JOURNAL_SUFFIX = ".journal"
+# attempts of a request failing with a transient error, delays in seconds of the exponential backoff and number of
+# retries allowed per run
+MAX_REQUEST_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1
+RETRY_MAX_DELAY = 32
+DEFAULT_RETRY_BUDGET = 500
+# http status and reasons of the api errors worth sending the request again, 429 is sent by the front ends throttling
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+TRANSIENT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "backendError", "internalError"}
+# weight of the last sample in the moving average of the throughput, sampled at a fixed interval
+THROUGHPUT_SMOOTHING = 0.2
+# percentiles of the durations given in the run report
+METRIC_PERCENTILES = (50, 95, 99)
+# columns of the results that can be checked, with the part and the partial response field requested for each
+RESULT_COLUMNS = {"madeForKids": ("status", "status/madeForKids"),
+                  "description": ("snippet", "snippet/description"),
+                  "topic": ("topicDetails", "topicDetails/topicIds")}
+# format of a channel id, hosts of the channel urls, first segments of youtube urls that are not channels and tabs
+# of a channel page, the only segments accepted after a legacy custom name
+CHANNEL_ID_PATTERN = re.compile(r"UC[\w-]{22}")
+YOUTUBE_HOSTS = {"youtube.com", "www.youtube.com", "m.youtube.com"}
+NON_CHANNEL_PATHS = {"watch", "video", "playlist", "shorts", "embed", "v", "e", "live", "results", "feed", "hashtag",
+                     "post", "clip", "source", "attribution_link", "redirect", "account", "premium", "gaming", "kids",
+                     "tv", "t", "about", "howyoutubeworks", "creators", "ads", "signin", "logout", "upload", "oembed",
+                     "playables", "podcasts", "channel_switcher"}
+CHANNEL_TABS = {"featured", "videos", "shorts", "streams", "live", "playlists", "community", "posts", "channels",
+                "about", "podcasts", "releases", "store", "search"}
+# topic ids of the channels grouped by parent category {category: {topic_id: label}}, edit the file to add topics
+TOPIC_TAXONOMY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "topics.json")
+with open(TOPIC_TAXONOMY_PATH, encoding="utf-8") as taxonomy_file:
+    TOPIC_TAXONOMY = json.load(taxonomy_file)
+# label of each topic id and parent category of each label
+TOPIC_LABELS = {topic_id: label for topics in TOPIC_TAXONOMY.values() for topic_id, label in topics.items()}
+TOPIC_CATEGORIES = {label: category for category, topics in TOPIC_TAXONOMY.items() for label in topics.values()}
+# columns of the results tab, the topic is followed by a boolean column per parent category and the time of the check
+RESULTS_HEADER = ["Placement", "Placement URL", "madeForKids", "Description", "Default Language", "Topic",
+                  *TOPIC_TAXONOMY, "Checked at"]
+# format of the time of the check, the time the channel was fetched for the channels read from the cache
+CHECKED_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+# madeForKids statuses of the rows checked again by a refresh, whatever their age, and default age of the rows
+# checked again in days
+REFRESH_STATUSES = ("error", "No data")
+DEFAULT_REFRESH_DAYS = 90
+# number of columns of the results tab before the categories, the columns found in the files of all versions
+RESULTS_BASE_COLUMNS = 6
+# table of the results in the SQLite output, number of rows of a row group of the Parquet output and column of the
+# Parquet output with the madeForKids statuses ('No data', 'error') so madeForKids stays a boolean column
+RESULTS_TABLE = "results"
+PARQUET_ROW_GROUP_SIZE = 10000
+PARQUET_STATUS_COLUMN = "madeForKids status"
+# namespaces, relationship and content types of the parts of an Excel file rewritten when a sheet is replaced
+SPREADSHEET_NAMESPACE = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELATIONSHIPS_NAMESPACE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_RELATIONSHIPS_NAMESPACE = "http://schemas.openxmlformats.org/package/2006/relationships"
+WORKSHEET_RELATIONSHIP = RELATIONSHIPS_NAMESPACE + "/worksheet"
+WORKSHEET_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+
+
+def get_youtube_api_service(api_key):
+    """Sets the header of api request with correct service, version and user token
+
+    The root url of the api can be replaced with the YOUTUBE_API_ENDPOINT environment variable.
+
+    Parameters
+    ----------
+    api_key : str
+        user's token
+    """
+    api_service_name = "youtube"
+    api_version = "v3"
+    api_endpoint = os.environ.get(API_ENDPOINT_VARIABLE)
+    client_options = {"api_endpoint": api_endpoint} if api_endpoint else None
+    return build(api_service_name, api_version, developerKey=api_key, client_options=client_options)
+
+
+def write_sheets(path, sheets):
+    """Replaces or adds sheets of the Excel file atomically, the other parts of the file are copied unchanged
+
+    The file is rewritten at the level of its zip package: the xml of the given sheets is streamed from their rows and
+    every other part is copied byte for byte, so the other sheets keep their formatting, column widths and hyperlinks.
+    The given sheets are written with their values only, the formatting applied to them is not kept, and the new ones
+    are added after the others. A crash while writing never leaves a corrupted file: the package is written in a
+    temporary file of the same directory then renamed over the original file.
+
+    Parameters
+    ----------
+    path : str
+        path of the file
+    sheets : dict
+        {sheet name: iterable of rows} of the sheets to write, the rows are consumed while the file is written
+    """
+    def get_relationships_part(part):
+        """Get the name of the part holding the relationships of a part of the package"""
+        return posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+
+    def read_relationships(part):
+        """Get {id: (type, target part)} of the relationships of a part of the package"""
+        root = xml.etree.ElementTree.fromstring(source.read(get_relationships_part(part)))
+        relationships = {}
+        for relationship in root.iter(f"{{{PACKAGE_RELATIONSHIPS_NAMESPACE}}}Relationship"):
+            target = relationship.get("Target")
+            # the targets are relative to the directory of the part, or to the package when they start with /
+            relationships[relationship.get("Id")] = (relationship.get("Type"), target[1:] if target.startswith("/")
+                                                     else posixpath.normpath(posixpath.join(posixpath.dirname(part),
+                                                                                            target)))
+        return relationships
+
+    def insert_element(text, tag, element):
+        """Insert an element before the closing tag of an xml part, with the namespace prefix of the tag"""
+        closing_tag = re.search(rf"</(\w+:)?{tag}>", text)
+        return text[:closing_tag.start()] + element.format(closing_tag.group(1) or "") + text[closing_tag.start():]
+
+    with zipfile.ZipFile(path) as source:
+        workbook_part = next(target for relationship_type, target in read_relationships("").values()
+                             if relationship_type.endswith("/officeDocument"))
+        relationships = read_relationships(workbook_part)
+        workbook_xml = source.read(workbook_part).decode("utf-8")
+        relationships_xml = source.read(get_relationships_part(workbook_part)).decode("utf-8")
+        content_types_xml = source.read("[Content_Types].xml").decode("utf-8")
+
+        sheet_elements = list(xml.etree.ElementTree.fromstring(workbook_xml).iter(f"{{{SPREADSHEET_NAMESPACE}}}sheet"))
+        sheet_parts = {sheet.get("name"): relationships[sheet.get(f"{{{RELATIONSHIPS_NAMESPACE}}}id")][1]
+                       for sheet in sheet_elements}
+        sheet_id = max((int(sheet.get("sheetId")) for sheet in sheet_elements), default=0)
+        relationships_prefix = re.search(rf'xmlns:(\w+)="{re.escape(RELATIONSHIPS_NAMESPACE)}"', workbook_xml).group(1)
+
+        # {part: sheet name} of the sheets written and parts of the old sheets no longer referenced
+        written_parts = {}
+        dropped_parts = set()
+        for sheet_name in sheets:
+            if sheet_name in sheet_parts:
+                written_parts[sheet_parts[sheet_name]] = sheet_name
+                # tables, comments or hyperlinks of the old sheet
+                dropped_parts.add(get_relationships_part(sheet_parts[sheet_name]))
+                continue
+
+            # declare the new sheet in the workbook, its relationships and the content types of the package
+            sheet_number = len(sheet_parts) + len(written_parts) + 1
+            while (part := posixpath.join(posixpath.dirname(workbook_part), f"worksheets/sheet{sheet_number}.xml")) \
+                    in source.namelist() or part in written_parts:
+                sheet_number += 1
+            relationship_number = len(relationships) + 1
+            while f"rId{relationship_number}" in relationships:
+                relationship_number += 1
+            relationship_id = f"rId{relationship_number}"
+            relationships[relationship_id] = (WORKSHEET_RELATIONSHIP, part)
+            written_parts[part] = sheet_name
+            sheet_id += 1
+
+            workbook_xml = insert_element(workbook_xml, "sheets", (
+                f'<{{0}}sheet name={quoteattr(sheet_name)} sheetId="{sheet_id}" '
+                f'{relationships_prefix}:id="{relationship_id}"/>'))
+            relationships_xml = insert_element(relationships_xml, "Relationships", (
+                f'<{{0}}Relationship Id="{relationship_id}" Type="{WORKSHEET_RELATIONSHIP}" Target="/{part}"/>'))
+            content_types_xml = insert_element(content_types_xml, "Types", (
+                f'<{{0}}Override PartName="/{part}" ContentType="{WORKSHEET_CONTENT_TYPE}"/>'))
+
+        if dropped_parts:
+            # the calculation chain may list cells of the old sheets, Excel builds it again when it is missing
+            for relationship_id, (relationship_type, part) in relationships.items():
+                if relationship_type.endswith("/calcChain"):
+                    dropped_parts.add(part)
+                    relationships_xml = re.sub(rf'<(\w+:)?Relationship [^>]*Id="{relationship_id}"[^>]*/>', "",
+                                               relationships_xml)
+                    content_types_xml = re.sub(rf'<(\w+:)?Override [^>]*PartName="/{re.escape(part)}"[^>]*/>', "",
+                                               content_types_xml)
+
+        changed_parts = {workbook_part: workbook_xml, get_relationships_part(workbook_part): relationships_xml,
+                         "[Content_Types].xml": content_types_xml}
+
+        file_descriptor, temp_path = tempfile.mkstemp(suffix=".xlsx", dir=os.path.dirname(os.path.abspath(path)))
+        os.close(file_descriptor)
+        try:
+            with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as output:
+                for info in source.infolist():
+                    if info.filename in dropped_parts or info.filename in written_parts:
+                        continue
+                    if info.filename in changed_parts:
+                        output.writestr(info.filename, changed_parts[info.filename])
+                        continue
+                    # stream the part, the sheets of large files don't fit in memory once uncompressed
+                    with source.open(info) as part_file, output.open(info.filename, "w", force_zip64=True) as copy:
+                        shutil.copyfileobj(part_file, copy)
+
+                for part, sheet_name in written_parts.items():
+                    with output.open(part, "w", force_zip64=True) as sheet_file:
+                        write_sheet_xml(sheet_file, sheets[sheet_name])
+
+            # keep the permissions of the original file, the temporary file is only readable by its owner
+            shutil.copymode(path, temp_path)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+def write_sheet_xml(file, rows):
+    """Writes the xml of a sheet with the values of its rows
+
+    The strings are written inline so the shared strings of the file are left unchanged, the characters not allowed
+    in xml are removed and the dates are written as text, the times of check in the CHECKED_AT_FORMAT format.
+
+    Parameters
+    ----------
+    file : io.BufferedIOBase
+        binary file the xml is written to
+    rows : iterable
+        values of the rows, None for the empty cells
+    """
+    file.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+               f'<worksheet xmlns="{SPREADSHEET_NAMESPACE}"><sheetData>'.encode("utf-8"))
+    for row_number, row in enumerate(rows, start=1):
+        cells = []
+        for column_number, value in enumerate(row, start=1):
+            if value is None:
+                continue
+            reference = f"{get_column_letter(column_number)}{row_number}"
+            if isinstance(value, bool):
+                cells.append(f'<c r="{reference}" t="b"><v>{int(value)}</v></c>')
+            elif isinstance(value, (int, float)) and math.isfinite(value):
+                cells.append(f'<c r="{reference}"><v>{value!r}</v></c>')
+            else:
+                if isinstance(value, datetime.datetime):
+                    value = value.strftime(CHECKED_AT_FORMAT)
+                elif isinstance(value, (datetime.date, datetime.time)):
+                    value = value.isoformat()
+                text = ILLEGAL_CHARACTERS_RE.sub("", str(value))
+                # keep the spaces at the ends of the text
+                space = ' xml:space="preserve"' if text != text.strip() else ""
+                cells.append(f'<c r="{reference}" t="inlineStr"><is><t{space}>{escape(text)}</t></is></c>')
+        file.write(f'<row r="{row_number}">{"".join(cells)}</row>'.encode("utf-8"))
+    file.write(b"</sheetData></worksheet>")
+
+
+def strip_row(row):
+    """Get the values of a row without the empty cells at its end
+
+    Parameters
+    ----------
+    row : tuple
+        values of the row
+    """
+    row = list(row)
+    while row and row[-1] is None:
+        row.pop()
+    return row
+
+
+def is_results_header(header):
+    """Check if a row is the header of the results tab, of this version or of an earlier one with other categories
+
+    The columns are found by name, the categories of topics.json may have been edited since the file was written.
+
+    Parameters
+    ----------
+    header : list
+        values of the first row of the sheet without the empty cells at its end
+    """
+    return set(RESULTS_HEADER[:RESULTS_BASE_COLUMNS]) <= set(header)
+
+
+def get_column_positions(header):
+    """Get the position of each column of a header, the first one when a name is repeated
+
+    Parameters
+    ----------
+    header : list
+        values of the first row of the sheet
+
+    Returns
+    -------
+    dict
+        {name: index} of the columns
+    """
+    positions = {}
+    for i, name in enumerate(header):
+        positions.setdefault(name, i)
+    return positions
+
+
+def get_results_layout(header):
+    """Gets the header of a results tab upgraded to RESULTS_HEADER and the position of its columns in the old rows
+
+    The columns of RESULTS_HEADER missing from the header are added, the columns unknown to this version, e.g. a
+    category removed from topics.json, are kept after them so no value is lost.
+
+    Parameters
+    ----------
+    header : list
+        values of the first row of the results tab, as accepted by is_results_header
+
+    Returns
+    -------
+    tuple
+        upgraded header, and index in the old rows of each of its columns, None for the columns added, or None
+        instead of the indexes when the header is already RESULTS_HEADER
+    """
+    header = strip_row(header)
+    if header == RESULTS_HEADER:
+        return RESULTS_HEADER, None
+
+    positions = get_column_positions(header)
+    new_header = RESULTS_HEADER + [name for name in positions if name is not None and name not in RESULTS_HEADER]
+    return new_header, [positions.get(name) for name in new_header]
+
+
+def get_result_row(channel_name, channel_url, made_for_kids, description, language, topic, checked_at=None):
+    """Gets the row of a channel in the results, with its topic split in a boolean per parent category and the time
+    of the check
+
+    The categories are left empty when the topic is unknown. The labels of the topic ids missing from the taxonomy
+    are their raw id and belong to no category.
+
+    Parameters
+    ----------
+    channel_name : str
+        name of the placement
+    channel_url : str
+        url of the placement
+    made_for_kids : bool
+        madeForKids status of the channel, "No data" or "error"
+    description : str
+        description of the channel
+    language : str
+        language detected on the channel
+    topic : str
+        labels of the topics of the channel separated by commas
+    checked_at : float
+        timestamp of the check, default to now
+
+    Returns
+    -------
+    list
+        values of the row in the order of RESULTS_HEADER
+    """
+    if topic in (None, "No data", "error"):
+        categories = [None] * len(TOPIC_TAXONOMY)
+    else:
+        channel_categories = {TOPIC_CATEGORIES.get(label) for label in topic.split(", ")}
+        categories = [category in channel_categories for category in TOPIC_TAXONOMY]
+
+    checked_at = time.strftime(CHECKED_AT_FORMAT, time.localtime(checked_at))
+    return [channel_name, channel_url, made_for_kids, description, language, topic, *categories, checked_at]
+
+
+def is_stale_result(row, refresh_before, columns):
+    """Check if a row of the results must be checked again by a refresh
+
+    The rows of errors and without data are always checked again, the others when they were checked before the
+    limit. The rows of earlier versions have no time of check and are checked again.
+
+    Parameters
+    ----------
+    row : tuple
+        values of the row in the Results tab
+    refresh_before : datetime.datetime
+        rows checked before this time are stale
+    columns : dict
+        position of the columns of the Results tab {name: index}, as returned by get_column_positions
+    """
+    def get_value(name):
+        """Get the value of a column of the row, None if the file has no such column"""
+        index = columns.get(name)
+        return row[index] if index is not None and index < len(row) else None
+
+    if get_value("madeForKids") in REFRESH_STATUSES:
+        return True
+
+    # the time is written as text, Excel may have turned it into a date
+    checked_at = get_value("Checked at")
+    if isinstance(checked_at, str):
+        try:
+            checked_at = datetime.datetime.strptime(checked_at.strip(), CHECKED_AT_FORMAT)
+        except ValueError:
+            checked_at = None
+
+    return not isinstance(checked_at, datetime.datetime) or checked_at < refresh_before
+
+
+class ResultsFile:
+    """Appends the results to the Results sheet of the Excel file while keeping the memory flat
+
+    The file is never loaded in memory: only the rows added since the last save are kept, and saving streams the
+    Results sheet of the file in read-only mode into a new Results sheet followed by these rows, the other parts of
+    the file are copied unchanged by write_sheets. The rows of urls already in the Results sheet, checked again by a
+    refresh, replace the old rows in place.
+    Streaming the file costs its whole size, so the checkpoints append the rows to a journal next to the file instead,
+    the journal is merged in the file on save. The journal of a run killed or crashed is merged by load_channels.
+
+    Methods
+    -------
+    append(rows)
+        add rows to the results
+    checkpoint()
+        append the rows added since the last checkpoint to the journal
+    has_pending_rows()
+        check if rows are waiting to be written in the file
+    read_journal()
+        read the rows of the journal
+    save()
+        write the rows of the journal and the rows added since the last save in the Results sheet
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            path of the Excel file
+        """
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.pending_rows = []
+
+    def append(self, rows):
+        """Add rows to the results, they are written in the file on the next save
+
+        Parameters
+        ----------
+        rows : list
+            values of the rows in the order of RESULTS_HEADER
+        """
+        self.pending_rows.extend(rows)
+
+    def checkpoint(self):
+        """Append the rows added since the last checkpoint to the journal, the cost doesn't grow with the file"""
+        if not self.pending_rows:
+            return
+
+        with open(self.journal_path, "a", encoding="utf-8") as file:
+            file.writelines(json.dumps(row) + "\n" for row in self.pending_rows)
+            file.flush()
+            os.fsync(file.fileno())
+        self.pending_rows = []
+
+    def has_pending_rows(self):
+        """Check if rows are waiting in memory or in the journal to be written in the file"""
+        return bool(self.pending_rows) or os.path.exists(self.journal_path)
+
+    def read_journal(self):
+        """Read the rows of the journal, empty if there is no journal
+
+        Returns
+        -------
+        list
+            rows of the journal in the order they were written
+        """
+        if not os.path.exists(self.journal_path):
+            return []
+
+        rows = []
+        with open(self.journal_path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # last line cut by a crash while it was written
+                    continue
+        return rows
+
+    def save(self):
+        """Write the rows of the journal and the rows added since the last save in the Results sheet, created if it
+        doesn't exist, the journal is removed once the file is saved
+
+        The rows of urls already in the sheet replace the old rows, the others are written at the end of the sheet.
+        """
+        self.pending_rows = self.read_journal() + self.pending_rows
+        pending_rows = {row[1]: row for row in self.pending_rows}
+        replaced_urls = set()
+
+        def get_rows(sheet):
+            """Get the rows of the Results sheet, None if the file has no Results sheet, followed by the new rows"""
+            if sheet is None:
+                yield RESULTS_HEADER
+            else:
+                # header and position of the columns in the old rows, None while the header is not a results header
+                layout = None
+                for i, row in enumerate(sheet.iter_rows(values_only=True)):
+                    if i == 0 and is_results_header(strip_row(row)):
+                        # rewrite the header of earlier versions or of other categories with the columns of this one
+                        layout = get_results_layout(row)
+                        row = layout[0]
+                    elif layout is not None:
+                        if layout[1] is not None:
+                            # move the values of the old row under their column in the new header
+                            row = [row[j] if j is not None and j < len(row) else None for j in layout[1]]
+                        if len(row) > 1 and row[1] in pending_rows:
+                            # update in place the rows checked again
+                            replaced_urls.add(row[1])
+                            row = pending_rows[row[1]]
+                    yield row
+
+            for row in self.pending_rows:
+                if row[1] not in replaced_urls:
+                    yield row
+
+        # only the Results sheet is written, the other sheets of the user keep their formatting
+        source = openpyxl.load_workbook(self.path, read_only=True)
+        try:
+            write_sheets(self.path, {"Results": get_rows(source["Results"] if "Results" in source.sheetnames
+                                                         else None)})
+        finally:
+            source.close()
+
+        self.pending_rows = []
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+
+class SharedResultsFile:
+    """Dispatches the results of the channels of several files to the results file of each file
+
+    The channels of all files are processed in one run: a url found in several files is fetched once and its row is
+    written in each of them, with the placement name of the file. It replaces a ResultsFile in check_channels.
+
+    Typical use:
+        shared_results_file = SharedResultsFile()
+        for path in paths:
+            channels, processed_channels = load_channels(path)
+            channels_to_process = {k: v for k, v in channels.items() if k not in processed_channels}
+            shared_results_file.add(ResultsFile(path), channels_to_process)
+        check_channels(shared_results_file.channels(), shared_results_file, quota_scheduler)
+
+    Methods
+    -------
+    add(results_file, channels)
+        add a file and its channels to process
+    channels()
+        get the channels to process of all files
+    append(rows)
+        add rows to the results of the files of their url
+    checkpoint()
+        append the rows added since the last checkpoint to the journal of each file
+    save()
+        save the files with rows added since the last save
+    """
+    def __init__(self):
+        self.results_files = []
+        self.file_channels = []
+        self.files_by_url = {}
+
+    def add(self, results_file, channels):
+        """Add a file and its channels to process
+
+        Parameters
+        ----------
+        results_file : ResultsFile
+            results file of the file
+        channels : dict
+            channels of the file to process {channel_url: channel_name}
+        """
+        for channel_url in channels:
+            self.files_by_url.setdefault(channel_url, []).append(len(self.results_files))
+        self.results_files.append(results_file)
+        self.file_channels.append(channels)
+
+    def channels(self):
+        """Get the channels to process of all files {channel_url: channel_name}, with the name of their first file"""
+        channels = {}
+        for file_channels in reversed(self.file_channels):
+            channels.update(file_channels)
+        return {channel_url: channels[channel_url] for channel_url in self.files_by_url}
+
+    def append(self, rows):
+        """Add rows to the results of the files where their url is to process
+
+        Parameters
+        ----------
+        rows : list
+            values of the rows in the order of RESULTS_HEADER
+        """
+        for row in rows:
+            for i in self.files_by_url[row[1]]:
+                self.results_files[i].append([[self.file_channels[i][row[1]], *row[1:]]])
+
+    def checkpoint(self):
+        """Append the rows added since the last checkpoint to the journal of each file"""
+        for results_file in self.results_files:
+            results_file.checkpoint()
+
+    def save(self):
+        """Save the files with rows added since the last save, in memory or in their journal"""
+        for results_file in self.results_files:
+            if results_file.has_pending_rows():
+                results_file.save()
+
+
+class CsvResultsFile:
+    """Streams the results in a csv file, the rows are written as they arrive
+
+    The rows are appended at the end of the file, the header is written when the file is created and checked when an
+    existing file is opened. A url checked again by a later run gets a new row, read the last row of each url by
+    Checked at to get the latest results.
+
+    Methods
+    -------
+    append(rows)
+        write rows at the end of the file
+    checkpoint()
+        flush the rows written to the disk
+    save()
+        flush the rows written to the disk
+    close()
+        close the file
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            path of the csv file
+
+        Raises
+        ------
+        ValueError
+            if the header of the existing file is not RESULTS_HEADER, e.g. after an edit of topics.json
+        """
+        self.path = path
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not is_new:
+            with open(path, newline="", encoding="utf-8") as file:
+                header = next(csv.reader(file), [])
+            if header != RESULTS_HEADER:
+                # the rows would be appended under the columns of another version
+                raise ValueError(f"{os.path.basename(path)} has other columns than the results of this version, "
+                                 f"write them in a new csv file")
+        self.file = open(path, "a", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        if is_new:
+            self.writer.writerow(RESULTS_HEADER)
+
+    def append(self, rows):
+        """Write rows at the end of the file
+
+        Parameters
+        ----------
+        rows : list
+            values of the rows in the order of RESULTS_HEADER
+        """
+        self.writer.writerows(rows)
+
+    def checkpoint(self):
+        """Flush the rows written to the disk"""
+        self.save()
+
+    def save(self):
+        """Flush the rows written to the disk"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        """Close the file"""
+        self.file.close()
+
+
+class SqliteResultsFile:
+    """Streams the results in the results table of a SQLite database, the rows are inserted as they arrive
+
+    The table has the columns of RESULTS_HEADER, the columns added by later versions are added to an existing table.
+    It keeps one row per url: a url checked again by a later run replaces its row, so running the same files again
+    doesn't duplicate them. A connection is opened for each call, like ChannelCache.
+
+    Methods
+    -------
+    append(rows)
+        insert or replace rows in the table
+    checkpoint()
+        nothing to do, the rows are committed when inserted
+    save()
+        nothing to do, the rows are committed when inserted
+    close()
+        nothing to do, no connection is kept open
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            path of the SQLite database, created if it doesn't exist
+        """
+        self.path = path
+        self.columns = ", ".join(f'"{column}"' for column in RESULTS_HEADER)
+
+        with contextlib.closing(sqlite3.connect(self.path)) as connection, connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {RESULTS_TABLE} ({self.columns})")
+            existing_columns = {row[1] for row in connection.execute(f"PRAGMA table_info({RESULTS_TABLE})")}
+            for column in RESULTS_HEADER:
+                if column not in existing_columns:
+                    connection.execute(f'ALTER TABLE {RESULTS_TABLE} ADD COLUMN "{column}"')
+
+            # keep the last row of each url of the tables written by earlier versions before indexing the urls
+            connection.execute(f'DELETE FROM {RESULTS_TABLE} WHERE rowid NOT IN '
+                               f'(SELECT MAX(rowid) FROM {RESULTS_TABLE} GROUP BY "Placement URL")')
+            connection.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {RESULTS_TABLE}_url '
+                               f'ON {RESULTS_TABLE} ("Placement URL")')
+
+    def append(self, rows):
+        """Insert rows in the table, the rows of urls already in the table replace them
+
+        Parameters
+        ----------
+        rows : list
+            values of the rows in the order of RESULTS_HEADER
+        """
+        with contextlib.closing(sqlite3.connect(self.path)) as connection, connection:
+            connection.executemany(f"INSERT OR REPLACE INTO {RESULTS_TABLE} ({self.columns}) "
+                                   f"VALUES ({', '.join('?' * len(RESULTS_HEADER))})", rows)
+
+    def checkpoint(self):
+        """Nothing to do, the rows are committed when inserted"""
+
+    def save(self):
+        """Nothing to do, the rows are committed when inserted"""
+
+    def close(self):
+        """Nothing to do, no connection is kept open"""
+
+
+class ParquetResultsFile:
+    """Streams the results in a Parquet file of a dataset folder, each run adds a file to the folder
+
+    The rows are written by row groups of PARQUET_ROW_GROUP_SIZE rows and on each save, the file is complete once
+    closed. madeForKids and the categories are nullable booleans, the statuses of madeForKids are in the
+    PARQUET_STATUS_COLUMN column after it and the other columns are strings. Each run writes its rows, read the last
+    row of each url by Checked at to get the latest results. Requires the optional pyarrow package.
+
+    Methods
+    -------
+    append(rows)
+        add rows to the current row group, written when it is full
+    checkpoint()
+        write the rows of the current row group
+    save()
+        write the rows of the current row group
+    close()
+        write the last rows and complete the file
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            path of the dataset folder, created if it doesn't exist
+
+        Raises
+        ------
+        ImportError
+            if pyarrow is not installed
+        """
+        if pyarrow is None:
+            raise ImportError("Install pyarrow to write the results in Parquet files")
+
+        os.makedirs(path, exist_ok=True)
+        self.path = os.path.join(path, f"results-{time.strftime('%Y%m%d-%H%M%S')}.parquet")
+        fields = []
+        for column in RESULTS_HEADER:
+            if column == "madeForKids":
+                fields.extend([(column, pyarrow.bool_()), (PARQUET_STATUS_COLUMN, pyarrow.string())])
+            else:
+                fields.append((column, pyarrow.bool_() if column in TOPIC_TAXONOMY else pyarrow.string()))
+        self.schema = pyarrow.schema(fields)
+        self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+        self.pending_rows = []
+
+    def append(self, rows):
+        """Add rows to the current row group, written when it is full
+
+        Parameters
+        ----------
+        rows : list
+            values of the rows in the order of RESULTS_HEADER
+        """
+        self.pending_rows.extend(rows)
+        if len(self.pending_rows) >= PARQUET_ROW_GROUP_SIZE:
+            self.save()
+
+    def checkpoint(self):
+        """Write the rows of the current row group"""
+        self.save()
+
+    def save(self):
+        """Write the rows of the current row group"""
+        if not self.pending_rows:
+            return
+
+        columns = dict(zip(RESULTS_HEADER, zip(*self.pending_rows)))
+        # madeForKids mixes booleans and statuses, the statuses are moved to their own column
+        made_for_kids = columns["madeForKids"]
+        columns["madeForKids"] = [value if isinstance(value, bool) else None for value in made_for_kids]
+        columns[PARQUET_STATUS_COLUMN] = [None if value is None or isinstance(value, bool) else str(value)
+                                          for value in made_for_kids]
+
+        arrays = [[value if value is None or field.type == pyarrow.bool_() else str(value)
+                   for value in columns[field.name]] for field in self.schema]
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+        self.pending_rows = []
+
+    def close(self):
+        """Write the last rows and complete the file"""
+        self.save()
+        self.writer.close()
+
+
+class CombinedResultsFile:
+    """Sends the results to several outputs, e.g. the Excel files and a csv file
+
+    Methods
+    -------
+    append(rows)
+        add rows to all outputs
+    checkpoint()
+        write a checkpoint of all outputs
+    save()
+        save all outputs
+    """
+    def __init__(self, results_files):
+        """
+        Parameters
+        ----------
+        results_files : list
+            outputs with the append, checkpoint and save methods of ResultsFile
+        """
+        self.results_files = results_files
+
+    def append(self, rows):
+        """Add rows to all outputs
+
+        Parameters
+        ----------
+        rows : list
+            values of the rows in the order of RESULTS_HEADER
+        """
+        for results_file in self.results_files:
+            results_file.append(rows)
+
+    def checkpoint(self):
+        """Write a checkpoint of all outputs"""
+        for results_file in self.results_files:
+            results_file.checkpoint()
+
+    def save(self):
+        """Save all outputs"""
+        for results_file in self.results_files:
+            results_file.save()
+
+
+def find_workbooks(paths):
+    """Gets the Excel files of a list of files and folders
+
+    Parameters
+    ----------
+    paths : list
+        paths of Excel files or of folders whose Excel files are taken, in alphabetical order
+
+    Returns
+    -------
+    list
+        paths of the Excel files without duplicates, the temporary files of Excel are ignored
+    """
+    workbooks = []
+    for path in paths:
+        if os.path.isdir(path):
+            workbooks.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                             if name.lower().endswith(".xlsx") and not name.startswith("~$"))
+        else:
+            workbooks.append(path)
+
+    return list(dict.fromkeys(workbooks))
+
+
+def parse_columns(text):
+    """Parses the columns of the results to check entered by the user
+
+    Parameters
+    ----------
+    text : str
+        names of RESULT_COLUMNS separated by commas or spaces, not case-sensitive
+
+    Returns
+    -------
+    tuple
+        columns in the order of RESULT_COLUMNS
+
+    Raises
+    ------
+    ValueError
+        if a column is unknown or no column is given
+    """
+    names = {name.lower() for name in text.replace(",", " ").split()}
+    columns = tuple(column for column in RESULT_COLUMNS if column.lower() in names)
+
+    unknown_columns = names - {column.lower() for column in columns}
+    if unknown_columns:
+        raise ValueError(f"Unknown column: {', '.join(sorted(unknown_columns))}")
+    if not columns:
+        raise ValueError("Check at least one column")
+
+    return columns
+
+
+def parse_languages(text):
+    """Parses the ISO 639-3 codes of the languages entered by the user
+
+    Parameters
+    ----------
+    text : str
+        codes separated by commas or spaces, empty for all languages
+
+    Returns
+    -------
+    tuple
+        sorted upper case codes without duplicates
+
+    Raises
+    ------
+    ValueError
+        if a code is unknown or only one language is given
+    """
+    languages = tuple(sorted({code.upper() for code in text.replace(",", " ").split()}))
+
+    unknown_languages = [code for code in languages if not hasattr(IsoCode639_3, code)]
+    if unknown_languages:
+        raise ValueError(f"Unknown language code: {', '.join(unknown_languages)}")
+    if len(languages) == 1:
+        raise ValueError("Enter at least two languages to detect")
+
+    return languages
+
+
+@functools.lru_cache(maxsize=None)
+def get_language_detector(languages=(), low_accuracy=False):
+    """Builds the language detector once per process for each settings and reuse it on the next runs
+
+    The language models are not preloaded, lingua loads only the models needed by the texts to detect.
+
+    Parameters
+    ----------
+    languages : tuple
+        ISO 639-3 codes the detection is restricted to, empty for all languages
+    low_accuracy : bool
+        use the low accuracy mode, faster and lighter but less reliable on short texts
+    """
+    if languages:
+        builder = LanguageDetectorBuilder.from_iso_codes_639_3(*[getattr(IsoCode639_3, code) for code in languages])
+    else:
+        builder = LanguageDetectorBuilder.from_all_languages()
+
+    if low_accuracy:
+        builder = builder.with_low_accuracy_mode()
+
+    return builder.build()
+
+
+def detect_languages(l_detector, channels):
+    """Detects the language of a block of channels with parallel calls of the detector
+
+    The descriptions are classified in one call, the names of the channels without result are classified in a
+    second call and their language is prefixed with 'low_' as the confidence is lower.
+
+    Parameters
+    ----------
+    l_detector : lingua.LanguageDetector
+        detector used for the block
+    channels : list
+        (channel_name, description) of each channel
+
+    Returns
+    -------
+    list
+        ISO 639-3 code of the language of each channel, 'error' or 'No Data', in the order of the channels
+    """
+    languages = ["error" if description == "error" else "No Data" for _, description in channels]
+
+    # classify the descriptions
+    to_detect = [i for i, (_, description) in enumerate(channels) if description not in ["error", "No data"]]
+    detected = l_detector.detect_languages_in_parallel_of([channels[i][1] for i in to_detect])
+
+    fallback = []
+    for i, language in zip(to_detect, detected):
+        if language:
+            languages[i] = language.iso_code_639_3.name
+        else:
+            fallback.append(i)
+
+    # classify the names of the channels without language found in their description
+    detected = l_detector.detect_languages_in_parallel_of([str(channels[i][0] or "") for i in fallback])
+
+    for i, language in zip(fallback, detected):
+        if language:
+            languages[i] = f'low_{language.iso_code_639_3.name}'
+
+    return languages
+
+
+def parse_channel_url(channel_url):
+    """Parses the forms of channel urls exported by Google Ads
+
+    Handles /channel/{id}, /@{handle}, /user/{username}, /c/{custom name} and legacy /{custom name} urls, with or
+    without scheme and www, trailing paths (/videos, /about) and query strings. A bare channel id and a path without
+    host are accepted too. The urls of other hosts, websites, apps and youtu.be videos, are not channel urls, neither
+    are the youtube pages of NON_CHANNEL_PATHS, e.g. the /video/{id} placements of videos. A legacy custom name is only
+    accepted alone or followed by a tab of the channel page, any other path is not a channel.
+
+    Parameters
+    ----------
+    channel_url : str
+        url of the channel
+
+    Returns
+    -------
+    tuple
+        (kind, value) with kind "id", "handle", "username" or "custom", None if the url is not a channel url
+    """
+    text = str(channel_url).strip()
+    if CHANNEL_ID_PATTERN.fullmatch(text):
+        return "id", text
+
+    if text.startswith("/"):
+        path = urlparse(text).path
+    else:
+        url = urlparse(text if "://" in text else f"https://{text}")
+        # a placement of another site would resolve to an unrelated channel of the same name
+        if (url.hostname or "") not in YOUTUBE_HOSTS:
+            return None
+        path = url.path
+    segments = [unquote(segment) for segment in path.split('/') if segment]
+
+    if not segments or segments[0].lower() in NON_CHANNEL_PATHS:
+        return None
+    elif segments[0].startswith("@"):
+        return "handle", segments[0]
+    elif segments[0].lower() in ("channel", "user", "c"):
+        if len(segments) < 2:
+            return None
+        return {"channel": "id", "user": "username", "c": "custom"}[segments[0].lower()], segments[1]
+    elif len(segments) == 1 or segments[1].lower() in CHANNEL_TABS:
+        return "custom", segments[0]
+    else:
+        return None
+
+
+def get_canonical_key(channel_url):
+    """Gets the key identifying the channel of a url before any request, the same for all the forms of its url
+
+    Parameters
+    ----------
+    channel_url : str
+        url of the channel
+
+    Returns
+    -------
+    str
+        channel id, key of the handle, username or custom name, None if the url is not a channel url
+    """
+    reference = parse_channel_url(channel_url)
+    if reference is None:
+        return None
+    return reference[1] if reference[0] == "id" else get_reference_key(reference)
+
+
+def count_unique_channels(channel_urls):
+    """Counts the channels of urls once canonicalized, the urls that are not channels are counted one by one
+
+    Parameters
+    ----------
+    channel_urls : iterable
+        urls of the channels
+    """
+    canonical_keys = [get_canonical_key(channel_url) for channel_url in channel_urls]
+    return len(set(canonical_keys) - {None}) + canonical_keys.count(None)
+
+
+def get_reference_key(reference):
+    """Gets the key of a handle, username or custom name in the persistent map, names are not case-sensitive
+
+    Parameters
+    ----------
+    reference : tuple
+        (kind, value) returned by parse_channel_url
+    """
+    kind, value = reference
+    return f"{kind}:{value.lstrip('@').lower()}"
+
+
+def resolve_channel_reference(api_service, reference):
+    """Gets the id of the channel of a handle, username or custom name with a single request
+
+    Custom names have no dedicated lookup, most of them were turned into handles so they are looked up as handles.
+
+    Parameters
+    ----------
+    api_service : googleapiclient.discovery.Resource
+        YouTube api service used to send the request
+    reference : tuple
+        (kind, value) returned by parse_channel_url
+
+    Returns
+    -------
+    str
+        id of the channel, empty if no channel matches
+    """
+    kind, value = reference
+    if kind == "username":
+        request = api_service.channels().list(part="id", forUsername=value, fields="items(id)")
+    else:
+        request = api_service.channels().list(part="id", forHandle=value, fields="items(id)")
+
+    items = request.execute().get('items', [])
+    return items[0]['id'] if items else ""
+
+
+def get_channels_properties(api_service, channel_ids, columns=tuple(RESULT_COLUMNS)):
+    """Gets the properties of a block of up to 50 channels with a single request
+
+    The channel ids are sent comma-separated in one channels().list call, which costs the same quota as a
+    single id. Items of the response are mapped back to the requested channels by id, channels without a matching
+    item are marked as 'No data'.
+    Only the parts of the checked columns are requested and a partial response mask limits the payload to the
+    fields read, the thumbnails, localized titles and other fields of the snippet are never sent.
+
+    Parameters
+    ----------
+    api_service : googleapiclient.discovery.Resource
+        YouTube api service used to send the request
+    channel_ids : list
+        unique ids of the channels of the block
+    columns : tuple
+        columns of RESULT_COLUMNS to check, the others are None
+
+    Returns
+    -------
+    dict
+        {channel_id: (made_for_kids, description, topic)}
+    """
+    request = api_service.channels().list(
+        part=",".join(RESULT_COLUMNS[column][0] for column in columns),
+        id=",".join(channel_ids),
+        maxResults=CHANNEL_BATCH_SIZE,
+        fields=f"items(id,{','.join(RESULT_COLUMNS[column][1] for column in columns)})"
+    )
+    response = request.execute()
+
+    # set 'No data' by default for channels missing from the response, None for the columns not checked
+    defaults = ['No data' if column in columns else None for column in RESULT_COLUMNS]
+    properties = {channel_id: tuple(defaults) for channel_id in channel_ids}
+
+    for channel_properties in response.get('items', []):
+        made_for_kids = channel_properties.get('status', {}).get('madeForKids', defaults[0])
+        description = channel_properties.get('snippet', {}).get('description', defaults[1])
+        topic = channel_properties.get('topicDetails', {}).get('topicIds', defaults[2])
+
+        if topic not in ['No data', None]:
+            # the topic ids missing from the taxonomy are kept as they are
+            topic = ", ".join([TOPIC_LABELS.get(x, x) for x in reversed(topic)])
+
+        if channel_properties.get('id') in properties:
+            properties[channel_properties['id']] = (made_for_kids, description, topic)
+
+    return properties
+
+
+class ChannelCache:
+    """Local SQLite cache of the channels properties and detected language, keyed by channel id
+
+    The same channels appear in every placement report, cached entries skip the request and the language detection.
+    The cache also keeps the map of the handles, usernames and custom names to their channel id.
+    A connection is opened for each call, the cache can be used from any thread.
+
+    Methods
+    -------
+    get_many(channel_ids)
+        get the entries of the channels updated within the ttl
+    put_many(entries)
+        insert or update entries of channels
+    get_channel_ids(reference_keys)
+        get the channel ids of handles, usernames and custom names resolved within the ttl
+    put_channel_ids(channel_ids)
+        insert or update channel ids of handles, usernames and custom names
+    """
+    def __init__(self, path, ttl_days=DEFAULT_CACHE_TTL_DAYS):
+        """
+        Parameters
+        ----------
+        path : str
+            path of the SQLite database, created with its directory if it doesn't exist
+        ttl_days : int
+            number of days an entry is valid
+        """
+        self.path = path
+        self.ttl = ttl_days * 24 * 3600
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with contextlib.closing(sqlite3.connect(self.path)) as connection, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS channels (channel_id TEXT PRIMARY KEY, made_for_kids TEXT, "
+                               "description TEXT, language TEXT, topic TEXT, updated_at REAL)")
+            connection.execute("CREATE TABLE IF NOT EXISTS channel_references (reference_key TEXT PRIMARY KEY, "
+                               "channel_id TEXT, updated_at REAL)")
+
+    def get_many(self, channel_ids):
+        """Get the entries of the channels updated within the ttl
+
+        Parameters
+        ----------
+        channel_ids : iterable
+            ids of the channels to look for
+
+        Returns
+        -------
+        dict
+            {channel_id: (made_for_kids, description, language, topic, updated_at)}
+        """
+        channel_ids = list(set(channel_ids))
+        entries = {}
+
+        with contextlib.closing(sqlite3.connect(self.path)) as connection:
+            # stay under the limit of variables of a SQLite query
+            for i in range(0, len(channel_ids), 500):
+                chunk = channel_ids[i:i + 500]
+                cursor = connection.execute(
+                    f"SELECT channel_id, made_for_kids, description, language, topic, updated_at FROM channels "
+                    f"WHERE updated_at >= ? AND channel_id IN ({','.join('?' * len(chunk))})",
+                    [time.time() - self.ttl, *chunk]
+                )
+                for channel_id, made_for_kids, description, language, topic, updated_at in cursor:
+                    # madeForKids is stored as json to keep the boolean value
+                    entries[channel_id] = (json.loads(made_for_kids), description, language, topic, updated_at)
+
+        return entries
+
+    def put_many(self, entries):
+        """Insert or update entries of channels
+
+        Parameters
+        ----------
+        entries : iterable
+            (channel_id, made_for_kids, description, language, topic) of each channel
+        """
+        now = time.time()
+        with contextlib.closing(sqlite3.connect(self.path)) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO channels VALUES (?, ?, ?, ?, ?, ?)",
+                [(channel_id, json.dumps(made_for_kids), description, language, topic, now)
+                 for channel_id, made_for_kids, description, language, topic in entries]
+            )
+
+    def get_channel_ids(self, reference_keys):
+        """Get the channel ids of handles, usernames and custom names resolved within the ttl
+
+        Parameters
+        ----------
+        reference_keys : iterable
+            keys returned by get_reference_key
+
+        Returns
+        -------
+        dict
+            {reference_key: channel_id}, the channel id is empty when no channel matched
+        """
+        reference_keys = list(set(reference_keys))
+        channel_ids = {}
+
+        with contextlib.closing(sqlite3.connect(self.path)) as connection:
+            # stay under the limit of variables of a SQLite query
+            for i in range(0, len(reference_keys), 500):
+                chunk = reference_keys[i:i + 500]
+                cursor = connection.execute(
+                    f"SELECT reference_key, channel_id FROM channel_references "
+                    f"WHERE updated_at >= ? AND reference_key IN ({','.join('?' * len(chunk))})",
+                    [time.time() - self.ttl, *chunk]
+                )
+                channel_ids.update(cursor)
+
+        return channel_ids
+
+    def put_channel_ids(self, channel_ids):
+        """Insert or update channel ids of handles, usernames and custom names
+
+        Parameters
+        ----------
+        channel_ids : dict
+            {reference_key: channel_id}
+        """
+        now = time.time()
+        with contextlib.closing(sqlite3.connect(self.path)) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO channel_references VALUES (?, ?, ?)",
+                [(reference_key, channel_id, now) for reference_key, channel_id in channel_ids.items()]
+            )
+
+
+class RetryPolicy:
+    """Sends again the requests failing with a transient error, with exponential backoff and jitter
+
+    Server errors, rate limits, timeouts and connection errors are transient. The number of retries is limited per
+    attempt and per run, a run against a failing api stops retrying once its budget is spent.
+
+    Methods
+    -------
+    is_transient(error)
+        check if an error is worth sending the request again
+    wait(attempt, error)
+        wait before the next attempt, returns False if the request must not be retried
+    """
+    def __init__(self, budget=DEFAULT_RETRY_BUDGET, max_attempts=MAX_REQUEST_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY):
+        """
+        Parameters
+        ----------
+        budget : int
+            number of retries allowed for the whole run
+        max_attempts : int
+            number of attempts of a request
+        base_delay : float
+            delay in seconds before the second attempt, doubled for each attempt
+        max_delay : float
+            maximum delay in seconds between two attempts
+        """
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_transient(error):
+        """Check if an error is worth sending the request again
+
+        Parameters
+        ----------
+        error : Exception
+            error raised by the request
+        """
+        if isinstance(error, HttpError):
+            # error_details holds the list of errors of the api response, with their reason
+            details = error.error_details if isinstance(error.error_details, list) else []
+            reasons = {detail.get('reason') for detail in details if isinstance(detail, dict)}
+            return error.resp.status in TRANSIENT_STATUS or bool(reasons & TRANSIENT_REASONS)
+
+        return isinstance(error, (TimeoutError, socket.timeout, ConnectionError, httplib2.ServerNotFoundError))
+
+    def wait(self, attempt, error):
+        """Wait before the next attempt of a request, returns False if the request must not be retried
+
+        Parameters
+        ----------
+        attempt : int
+            number of attempts already made
+        error : Exception
+            error raised by the last attempt
+        """
+        if attempt >= self.max_attempts or not self.is_transient(error):
+            return False
+
+        with self.lock:
+            if self.retries >= self.budget:
+                return False
+            self.retries += 1
+
+        # full jitter spreads the retries of the threads failing at the same time
+        time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))))
+        return True
+
+
+class RateLimiter:
+    """Token bucket shared by the fetching threads to stay under the requests per second limit of a token
+
+    Methods
+    -------
+    acquire()
+        wait until a token is available and consume it
+    """
+    def __init__(self, rate, capacity=None):
+        """
+        Parameters
+        ----------
+        rate : float
+            number of tokens added to the bucket per second
+        capacity : int
+            maximum number of tokens stored in the bucket, allows short bursts (default to rate)
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a token is available in the bucket and consume it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                # refill the bucket with the tokens earned since the last call
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait_time = (1 - self.tokens) / self.rate
+
+            time.sleep(wait_time)
+
+
+class RunMetrics:
+    """Records the durations of the stages of a run and its counters, shared by the threads of the run
+
+    The stages are "load" and "template_check" of the file, "api" for each request sent, "detection" for each block
+    of descriptions, "append", "checkpoint" and "save" of the results and "exclusions" when the exclusion lists are
+    built. The counters are "requests", "quota_units", "retries", "cache_hits" of channels and "reference_cache_hits"
+    of handles and custom names.
+
+    Typical use:
+        metrics = RunMetrics()
+        with metrics.measure("detection"):
+            ...
+        metrics.save("report.json")
+
+    Methods
+    -------
+    measure(stage)
+        context manager recording the duration of its block
+    record(stage, seconds)
+        add a duration to a stage
+    count(counter, value)
+        increase a counter
+    summary()
+        get the durations and counters of the run as a dictionary
+    save(path)
+        write the summary in a json file, or a csv file when the path ends with .csv
+    """
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.durations = collections.defaultdict(list)
+        self.counters = collections.Counter()
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        """Record the duration of the block, even when it raises an error
+
+        Parameters
+        ----------
+        stage : str
+            name of the stage
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        """Add a duration to a stage
+
+        Parameters
+        ----------
+        stage : str
+            name of the stage
+        seconds : float
+            duration of the stage
+        """
+        with self.lock:
+            self.durations[stage].append(seconds)
+
+    def count(self, counter, value=1):
+        """Increase a counter
+
+        Parameters
+        ----------
+        counter : str
+            name of the counter
+        value : int
+            value added to the counter
+        """
+        with self.lock:
+            self.counters[counter] += value
+
+    def summary(self):
+        """Get the durations and counters of the run
+
+        Returns
+        -------
+        dict
+            {"elapsed": seconds, "stages": {stage: {"count", "total", "mean", "p50", "p95", "p99"}},
+            "counters": {counter: value}}
+        """
+        with self.lock:
+            durations = {stage: sorted(values) for stage, values in self.durations.items()}
+            counters = dict(self.counters)
+
+        stages = {}
+        for stage, values in durations.items():
+            stages[stage] = {"count": len(values), "total": round(sum(values), 4),
+                             "mean": round(sum(values) / len(values), 4)}
+            # nearest-rank percentiles, exact on the small number of durations of a stage
+            for percentile in METRIC_PERCENTILES:
+                stages[stage][f"p{percentile}"] = round(values[math.ceil(percentile / 100 * len(values)) - 1], 4)
+
+        return {"elapsed": round(time.perf_counter() - self.start_time, 4), "stages": stages, "counters": counters}
+
+    def save(self, path):
+        """Write the summary of the run in a json file, or in a csv file when the path ends with .csv
+
+        Parameters
+        ----------
+        path : str
+            path of the report
+        """
+        summary = self.summary()
+
+        if not path.lower().endswith(".csv"):
+            with open(path, "w") as file:
+                json.dump(summary, file, indent=2)
+            return
+
+        # one row per stage then one row per counter, the counters only fill the count column
+        fields = ["metric", "count", "total", "mean", *[f"p{percentile}" for percentile in METRIC_PERCENTILES]]
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=fields)
+            writer.writeheader()
+            writer.writerow({"metric": "elapsed", "total": summary["elapsed"]})
+            for stage, values in summary["stages"].items():
+                writer.writerow({"metric": stage, **values})
+            for counter, value in summary["counters"].items():
+                writer.writerow({"metric": counter, "count": value})
+
+
+class ThroughputEstimator:
+    """Estimates the throughput and the time left of a run with an exponentially weighted moving average
+
+    The channels are reported by kind: "fetched" from the api, "cached" read from the cache and "skipped" when they
+    need no request or are left for the next run. Only the fetched channels enter the throughput, the others are done
+    instantly and only reduce the channels left. The clock starts at the first fetched block, so the loading of the
+    detector and the resolution of the urls don't slow the estimate down, and the throughput is sampled at a fixed
+    interval by the caller so a block of 50 channels doesn't make it jump.
+    Each fetched block costs one request, the quota of the channels left is projected from the channels per block so
+    the one-time resolution of the urls doesn't inflate it.
+
+    Methods
+    -------
+    add(count, kind)
+        report channels done
+    sample()
+        update the moving average with the channels fetched since the last sample
+    channels_left()
+        get the number of channels not done yet
+    time_left()
+        get the estimated number of seconds left
+    projected_quota()
+        get the estimated quota units needed by the channels left
+    """
+    def __init__(self, total, smoothing=THROUGHPUT_SMOOTHING):
+        """
+        Parameters
+        ----------
+        total : int
+            number of channels of the run
+        smoothing : float
+            weight of the last sample in the moving average, between 0 and 1
+        """
+        self.total = total
+        self.smoothing = smoothing
+        self.done = collections.Counter()
+        self.fetched_blocks = 0
+        self.channels_per_second = None
+        self.last_sample_time = None
+        self.last_sample_fetched = 0
+
+    def add(self, count, kind="fetched"):
+        """Report channels done
+
+        Parameters
+        ----------
+        count : int
+            number of channels
+        kind : str
+            "fetched", "cached" or "skipped"
+        """
+        self.done[kind] += count
+        self.fetched_blocks += kind == "fetched"
+
+        if kind == "fetched" and self.last_sample_time is None:
+            # start the clock at the first block, its channels were fetched before it
+            self.last_sample_time = time.monotonic()
+            self.last_sample_fetched = self.done["fetched"]
+
+    def sample(self):
+        """Update the moving average with the channels fetched since the last sample"""
+        if self.last_sample_time is None:
+            return
+
+        now = time.monotonic()
+        if now <= self.last_sample_time or (self.channels_per_second is None
+                                            and self.done["fetched"] == self.last_sample_fetched):
+            # wait for a second block before the first estimate, a first throughput of 0 would linger in the average
+            return
+
+        throughput = (self.done["fetched"] - self.last_sample_fetched) / (now - self.last_sample_time)
+        if self.channels_per_second is None:
+            self.channels_per_second = throughput
+        else:
+            self.channels_per_second = self.smoothing * throughput + (1 - self.smoothing) * self.channels_per_second
+        self.last_sample_time, self.last_sample_fetched = now, self.done["fetched"]
+
+    def channels_left(self):
+        """Get the number of channels not done yet"""
+        return max(self.total - sum(self.done.values()), 0)
+
+    def time_left(self):
+        """Get the estimated number of seconds left, None until the throughput is known"""
+        if not self.channels_per_second:
+            return None
+        return self.channels_left() / self.channels_per_second
+
+    def projected_quota(self):
+        """Get the estimated quota units needed by the channels left, None until channels are fetched"""
+        if not self.done["fetched"]:
+            return None
+        return math.ceil(self.fetched_blocks * CHANNEL_LIST_COST / self.done["fetched"] * self.channels_left())
+
+
+class QuotaExceededError(Exception):
+    """Raised when the daily quota of every token is exhausted"""
+
+
+class QuotaScheduler:
+    """Shares the daily quota of several tokens and switch to the next token when one is exhausted
+
+    Each token has a budget of units per day, a channels().list request costs 1 unit. A token is considered exhausted
+    when its budget is spent or when the api answers quotaExceeded for it.
+
+    Methods
+    -------
+    current_key()
+        get the first token with quota left
+    consume(key, units)
+        record the units spent by a request
+    exhaust(key)
+        mark a token as out of quota
+    remaining()
+        get the total quota left over all tokens
+    """
+    def __init__(self, api_keys, daily_quota=DAILY_QUOTA_PER_KEY):
+        """
+        Parameters
+        ----------
+        api_keys : list
+            valid tokens of the user
+        daily_quota : int
+            number of units each token can spend per day
+        """
+        self.api_keys = list(api_keys)
+        self.daily_quota = daily_quota
+        self.used_units = {key: 0 for key in self.api_keys}
+        self.lock = threading.Lock()
+
+    def current_key(self):
+        """Get the first token with quota left, raise QuotaExceededError if all tokens are exhausted"""
+        with self.lock:
+            for key in self.api_keys:
+                if self.used_units[key] < self.daily_quota:
+                    return key
+
+        raise QuotaExceededError("quotaExceeded for all tokens")
+
+    def consume(self, key, units=CHANNEL_LIST_COST):
+        """Record the units spent by a request
+
+        Parameters
+        ----------
+        key : str
+            token used for the request
+        units : int
+            quota cost of the request
+        """
+        with self.lock:
+            self.used_units[key] += units
+
+    def exhaust(self, key):
+        """Mark a token as out of quota after the api answered quotaExceeded
+
+        Parameters
+        ----------
+        key : str
+            token that reached its quota
+        """
+        with self.lock:
+            self.used_units[key] = self.daily_quota
+
+    def remaining(self):
+        """Get the total number of units left over all tokens"""
+        with self.lock:
+            return sum(max(self.daily_quota - used, 0) for used in self.used_units.values())
+
+
+class ChannelFetcher:
+    """Fetches blocks of channels concurrently with a bounded number of threads
+
+    googleapiclient's httplib2 transport is not thread-safe, each thread builds and keeps its own api service per token.
+    The results are given back in the order of the blocks whatever the order the requests complete.
+    When a token reaches its quota the request is sent again with the next token given by the quota scheduler, and
+    transient errors are retried as allowed by the retry policy.
+
+    Typical use:
+        fetcher = ChannelFetcher(QuotaScheduler(api_keys), workers=4)
+        for channel_batch, batch_properties, error in fetcher.fetch_in_order(channel_batches, stop_event):
+            ...
+
+    Methods
+    -------
+    execute(send_request)
+        send a request with the api service of the calling thread and the current token
+    fetch(channel_batch, columns)
+        get the properties of a block of channels from the calling thread
+    resolve(reference)
+        get the channel id of a handle, username or custom name from the calling thread
+    map_in_order(function, items, stop_event)
+        call the function on all items concurrently and yield the results in input order
+    fetch_in_order(channel_batches, stop_event, columns)
+        fetch all blocks concurrently and yield the results in input order
+    """
+    def __init__(self, quota_scheduler, workers=DEFAULT_FETCH_WORKERS, requests_per_second=MAX_REQUESTS_PER_SECOND,
+                 retry_policy=None, metrics=None):
+        """
+        Parameters
+        ----------
+        quota_scheduler : QuotaScheduler
+            give the token to use for each request
+        workers : int
+            number of threads sending requests at the same time
+        requests_per_second : float
+            maximum number of requests sent per second by all threads
+        retry_policy : RetryPolicy
+            policy of the transient errors, default to a new policy for the fetcher
+        metrics : RunMetrics
+            metrics receiving the latency of each request, the retries and the quota used
+        """
+        self.quota_scheduler = quota_scheduler
+        self.workers = max(1, workers)
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics or RunMetrics()
+        self.thread_data = threading.local()
+
+    def execute(self, send_request):
+        """Send a request with the api service of the calling thread and the current token
+
+        Parameters
+        ----------
+        send_request : callable
+            function sending the request with the api service given as argument and returning its result
+        """
+        if not hasattr(self.thread_data, "api_services"):
+            self.thread_data.api_services = {}
+
+        attempt = 0
+        while True:
+            # raise QuotaExceededError when all tokens are exhausted
+            api_key = self.quota_scheduler.current_key()
+            if api_key not in self.thread_data.api_services:
+                self.thread_data.api_services[api_key] = get_youtube_api_service(api_key)
+
+            self.rate_limiter.acquire()
+            attempt += 1
+            self.metrics.count("requests")
+            try:
+                with self.metrics.measure("api"):
+                    result = send_request(self.thread_data.api_services[api_key])
+            except Exception as e:
+                if isinstance(e, HttpError) and "quotaExceeded" in str(e):
+                    # switch to the next token and send the request again
+                    self.quota_scheduler.exhaust(api_key)
+                    continue
+                if self.retry_policy.wait(attempt, e):
+                    # send the request again after the backoff delay
+                    self.metrics.count("retries")
+                    continue
+                raise
+
+            self.quota_scheduler.consume(api_key)
+            self.metrics.count("quota_units", CHANNEL_LIST_COST)
+            return result
+
+    def fetch(self, channel_batch, columns=tuple(RESULT_COLUMNS)):
+        """Get the properties of a block of channels with the api service of the calling thread
+
+        Parameters
+        ----------
+        channel_batch : list
+            unique ids of the channels of the block
+        columns : tuple
+            columns of RESULT_COLUMNS to check
+        """
+        return self.execute(lambda api_service: get_channels_properties(api_service, channel_batch, columns))
+
+    def resolve(self, reference):
+        """Get the channel id of a handle, username or custom name with the api service of the calling thread
+
+        Parameters
+        ----------
+        reference : tuple
+            (kind, value) returned by parse_channel_url
+        """
+        return self.execute(lambda api_service: resolve_channel_reference(api_service, reference))
+
+    def map_in_order(self, function, items, stop_event):
+        """Call the function on the items concurrently and yield (item, result, error) in input order
+
+        The number of calls submitted ahead is bounded to keep memory flat on large files.
+        No new call is submitted once the stop_event is set or the caller stops iterating.
+
+        Parameters
+        ----------
+        function : callable
+            function sending the requests of an item
+        items : iterable
+            arguments of the function
+        stop_event : threading.Event
+            event set when the process must stop
+        """
+        pending = collections.deque()
+        items = iter(items)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                while True:
+                    # keep every thread busy with a small buffer of requests submitted ahead
+                    while len(pending) < self.workers * 2 and not stop_event.is_set():
+                        item = next(items, None)
+                        if item is None:
+                            break
+                        pending.append((item, executor.submit(function, item)))
+
+                    if not pending:
+                        return
+
+                    item, future = pending.popleft()
+                    try:
+                        yield item, future.result(), None
+                    except Exception as e:
+                        yield item, None, e
+
+            finally:
+                # drop the requests not started yet when the caller stops early
+                for _, future in pending:
+                    future.cancel()
+
+    def fetch_in_order(self, channel_batches, stop_event, columns=tuple(RESULT_COLUMNS)):
+        """Fetch the blocks concurrently and yield (channel_batch, batch_properties, error) in input order
+
+        Parameters
+        ----------
+        channel_batches : iterable
+            blocks of unique channel ids
+        stop_event : threading.Event
+            event set when the process must stop
+        columns : tuple
+            columns of RESULT_COLUMNS to check
+        """
+        return self.map_in_order(lambda channel_batch: self.fetch(channel_batch, columns), channel_batches, stop_event)
+
+
+class TemplateError(Exception):
+    """Raised when the Excel file can't be processed, the message is shown to the user"""
+
+
+def is_valid_api_key(api_key, quota_scheduler=None):
+    """Verifies the validity of a token by sending a request to the Google api under a try statement
+
+    A token whose daily quota is exhausted is valid, it is marked exhausted in the quota scheduler so the run starts
+    with the other tokens.
+
+    Parameters
+    ----------
+    api_key : str
+        user's token
+    quota_scheduler : QuotaScheduler
+        scheduler of the run the token is used by, None to only verify the token
+    """
+    try:
+        # try to send request to api with token provided
+        youtube = build('youtube', 'v3', developerKey=api_key)
+        youtube.videos().list(part='id', id='VIDEO_ID').execute()
+        return True
+
+    except HttpError as e:
+        if "quotaExceeded" in str(e):
+            # the token is valid but can't be used before its quota is reset
+            if quota_scheduler is not None:
+                quota_scheduler.exhaust(api_key)
+            return True
+        # if it catches an error the token is not valid
+        return False
+
+
+def find_invalid_api_keys(api_keys, quota_scheduler=None):
+    """Verifies the tokens concurrently, the verification takes the time of one request whatever their number
+
+    Parameters
+    ----------
+    api_keys : list
+        tokens of the user
+    quota_scheduler : QuotaScheduler
+        scheduler of the run the tokens are used by, the tokens out of quota are marked exhausted in it
+
+    Returns
+    -------
+    list
+        positions from 1 of the invalid tokens
+    """
+    if not api_keys:
+        return []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(api_keys), MAX_FETCH_WORKERS)) as executor:
+        valid_keys = list(executor.map(lambda api_key: is_valid_api_key(api_key, quota_scheduler), api_keys))
+    return [i for i, is_valid in enumerate(valid_keys, start=1) if not is_valid]
+
+
+def load_channels(path, metrics=None, refresh_days=None):
+    """Verifies if the file is matching the template and gets the channels to process
+
+    The file is streamed in read-only mode, only the values of the rows are read to keep large exports fast. The
+    journal left by a run killed or crashed is merged in the file first.
+
+    Parameters
+    ----------
+    path : str
+        path of the Excel file
+    metrics : RunMetrics
+        metrics receiving the duration of the loading, of the template check and of the merge of the journal
+    refresh_days : int
+        age in days of the results checked again, with the errors and the channels without data, None to check only
+        the channels not in the Results tab
+
+    Returns
+    -------
+    tuple
+        dictionary of the Data tab {channel_url: channel_name} and set of the urls already in the Results tab and
+        up to date
+
+    Raises
+    ------
+    TemplateError
+        if the template is incorrect, the file is empty or all the channels are already processed
+    """
+    def read_header(sheet):
+        """Read the values of the first row of a sheet without the empty cells at its end"""
+        return strip_row(next(sheet.iter_rows(max_row=1, values_only=True), ()))
+
+    metrics = metrics or RunMetrics()
+    channels = {}
+    processed_channels = set()
+
+    # replay the checkpoints of the last run when it didn't save the file
+    results_file = ResultsFile(path)
+    if results_file.has_pending_rows():
+        with metrics.measure("save"):
+            results_file.save()
+
+    # load the file in read-only mode
+    with metrics.measure("load"):
+        workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        with metrics.measure("template_check"):
+            data_header = read_header(workbook["Data"]) if "Data" in workbook.sheetnames else None
+            results_header = read_header(workbook["Results"]) if "Results" in workbook.sheetnames else None
+        if ["Placement", "Placement URL"] != data_header:
+            raise TemplateError("Template file incorrect")
+
+        with metrics.measure("load"):
+            # get the channels to process
+            for row in workbook["Data"].iter_rows(min_row=2, values_only=True):
+                if len(row) > 1 and row[1]:
+                    channels[row[1]] = row[0]
+
+            # if there is a result tab, get the urls of the processed channels, but the stale ones on a refresh
+            if results_header and is_results_header(results_header):
+                refresh_before = (None if refresh_days is None else
+                                  datetime.datetime.now() - datetime.timedelta(days=refresh_days))
+                columns = get_column_positions(results_header)
+                url_column = columns["Placement URL"]
+                for row in workbook["Results"].iter_rows(min_row=2, values_only=True):
+                    if len(row) > url_column and (refresh_before is None
+                                                  or not is_stale_result(row, refresh_before, columns)):
+                        processed_channels.add(row[url_column])
+    finally:
+        workbook.close()
+
+    # if there is no channel to process rise error
+    if not channels:
+        raise TemplateError("Empty file")
+
+    # if the channels are already processed rise error
+    if all(channel_url in processed_channels for channel_url in channels):
+        raise TemplateError("Channels already processed" if refresh_days is None else "Channels already up to date")
+
+    return channels, processed_channels
+
+
+def resolve_channel_ids(channels, channel_fetcher, channel_cache, stop_event):
+    """Gets the channel id of every url, handles, usernames and custom names are resolved in bulk
+
+    The names already resolved are read from the persistent map of the cache, the others are resolved concurrently
+    with one request per name and saved in the map, a same name is resolved only once.
+
+    Parameters
+    ----------
+    channels : dict
+        channels to process {channel_url: channel_name}
+    channel_fetcher : ChannelFetcher
+        fetcher sending the requests
+    channel_cache : ChannelCache
+        cache keeping the map of the names to their channel id
+    stop_event : threading.Event
+        event set when the process must stop
+
+    Returns
+    -------
+    tuple
+        {channel_url: channel_id} of the resolved urls, {channel_url: "No data", "error" or "retry"} of the others,
+        "retry" marking the urls whose resolution failed with a transient error or was stopped by the quota, and True
+        if all the tokens are exhausted
+    """
+    channel_ids = {}
+    unresolved_channels = {}
+    references = {}
+
+    for channel_url in channels:
+        reference = parse_channel_url(channel_url)
+        if reference is None:
+            unresolved_channels[channel_url] = "No data"
+        elif reference[0] == "id":
+            channel_ids[channel_url] = reference[1]
+        else:
+            references[channel_url] = reference
+
+    # resolve each name once, with the persistent map first
+    reference_keys = {get_reference_key(reference): reference for reference in references.values()}
+    resolved = channel_cache.get_channel_ids(reference_keys)
+    channel_fetcher.metrics.count("reference_cache_hits", len(resolved))
+    to_resolve = [reference for reference_key, reference in reference_keys.items() if reference_key not in resolved]
+
+    new_resolved = {}
+    transient_failures = set()
+    quota_exceeded = False
+    resolutions = channel_fetcher.map_in_order(channel_fetcher.resolve, to_resolve, stop_event)
+    for i, (reference, channel_id, error) in enumerate(resolutions):
+        if isinstance(error, QuotaExceededError):
+            # the names not resolved yet are left for the next run, the urls already known are still processed
+            quota_exceeded = True
+            transient_failures.update(get_reference_key(reference) for reference in to_resolve[i:])
+            resolutions.close()
+            break
+        elif error:
+            print(f"Error resolving {reference[1]}: {str(error)}")
+            if RetryPolicy.is_transient(error):
+                transient_failures.add(get_reference_key(reference))
+        else:
+            new_resolved[get_reference_key(reference)] = channel_id
+
+    channel_cache.put_channel_ids(new_resolved)
+    resolved.update(new_resolved)
+
+    for channel_url, reference in references.items():
+        channel_id = resolved.get(get_reference_key(reference))
+        if channel_id:
+            channel_ids[channel_url] = channel_id
+        elif get_reference_key(reference) in transient_failures:
+            # the request failed with a transient error, the url is left for the next run
+            unresolved_channels[channel_url] = "retry"
+        else:
+            # no channel matches the name, or the request failed
+            unresolved_channels[channel_url] = "error" if channel_id is None else "No data"
+
+    return channel_ids, unresolved_channels, quota_exceeded
+
+
+def check_channels(channels, results_file, quota_scheduler, workers=DEFAULT_FETCH_WORKERS, use_cache=True,
+                   cache_ttl=DEFAULT_CACHE_TTL_DAYS, languages=(), low_accuracy=False,
+                   retry_budget=DEFAULT_RETRY_BUDGET, columns=tuple(RESULT_COLUMNS),
+                   requests_per_second=MAX_REQUESTS_PER_SECOND, cache_path=CHANNEL_CACHE_PATH, stop_event=None,
+                   results_lock=None, on_progress=None, metrics=None):
+    """Processes the channels and appends their properties to the results file
+
+    The urls are first resolved to channel ids and grouped by channel, so a channel appearing under several urls is
+    fetched and classified once and written on every url. The urls without channel and the channels found in the
+    cache are written first, the others are fetched concurrently by blocks, their language is detected and they are
+    written in the order of the file.
+    A checkpoint of the results is written every CHECKPOINT_CHANNELS channels or CHECKPOINT_INTERVAL seconds, in the
+    journal of the Excel files, a run killed or crashed resumes from the last checkpoint. The final save, merging the
+    journal in the file, is left to the caller.
+    Transient errors are retried with backoff, the channels still failing are not written so the next run on the
+    file sends them again.
+
+    Parameters
+    ----------
+    channels : dict
+        channels to process {channel_url: channel_name}
+    results_file : ResultsFile
+        file where the results are appended, or SharedResultsFile of the files of the channels
+    quota_scheduler : QuotaScheduler
+        scheduler of the user's tokens
+    workers : int
+        number of threads sending requests at the same time
+    use_cache : bool
+        read the channels found in the local cache instead of sending requests
+    cache_ttl : int
+        number of days a cached channel is valid
+    languages : tuple
+        ISO 639-3 codes the language detection is restricted to, empty for all languages
+    low_accuracy : bool
+        use the faster low accuracy mode of the language detection
+    retry_budget : int
+        number of retries of transient errors allowed for the run
+    columns : tuple
+        columns of RESULT_COLUMNS to check, the language is detected only when the description is checked and the
+        results of partial checks are not cached
+    requests_per_second : float
+        maximum number of requests sent per second by all threads
+    cache_path : str
+        path of the SQLite database of the cache
+    stop_event : threading.Event
+        event set when the process must stop, no row is written once it is set
+    results_lock : threading.Lock
+        lock held while rows are written, the caller holds it to save the results file safely
+    on_progress : callable
+        called after each block with the number of channels written or left for the next run and their kind,
+        "fetched", "cached" or "skipped", as expected by ThroughputEstimator.add
+    metrics : RunMetrics
+        metrics receiving the durations of the stages, the requests and the cache hits of the run
+
+    Returns
+    -------
+    str
+        "done" when all channels are processed, "retry" when channels were left for the next run after transient
+        errors, "quota" when all tokens are exhausted, "stopped" otherwise
+    """
+    stop_event = stop_event or threading.Event()
+    results_lock = results_lock or threading.Lock()
+    metrics = metrics or RunMetrics()
+
+    def write_rows(rows, kind="fetched"):
+        """Append rows to the results and report progress, returns False if the process was stopped"""
+        nonlocal checkpoint_channels, checkpoint_time
+
+        with results_lock:
+            if stop_event.is_set():
+                # results were already saved by the caller, drop the rows in flight
+                return False
+            # append the channels properties to the results
+            with metrics.measure("append"):
+                results_file.append(rows)
+
+            # write a checkpoint of the results regularly to not lose them on crash
+            checkpoint_channels += len(rows)
+            if checkpoint_channels >= CHECKPOINT_CHANNELS or time.time() - checkpoint_time >= CHECKPOINT_INTERVAL:
+                with metrics.measure("checkpoint"):
+                    results_file.checkpoint()
+                checkpoint_channels, checkpoint_time = 0, time.time()
+
+        if on_progress:
+            on_progress(len(rows), kind)
+        return True
+
+    # Initialize the checkpoints
+    checkpoint_channels, checkpoint_time = 0, time.time()
+
+    # Get the Language Detection, built once per process and settings, models are loaded when first needed
+    l_detector = get_language_detector(languages, low_accuracy) if "description" in columns else None
+
+    if stop_event.is_set():
+        # user stopped the process while the detector was loading
+        return "stopped"
+
+    # Initialize the concurrent fetching of the channels
+    channel_cache = ChannelCache(cache_path, ttl_days=cache_ttl)
+    channel_fetcher = ChannelFetcher(quota_scheduler, workers=workers, requests_per_second=requests_per_second,
+                                     retry_policy=RetryPolicy(budget=retry_budget), metrics=metrics)
+    retry_channels = 0
+
+    # get the channel id of every url, handles and custom names are resolved with the persistent map or the api
+    channel_ids, unresolved_channels, quota_exceeded = resolve_channel_ids(channels, channel_fetcher, channel_cache,
+                                                                           stop_event)
+
+    # write the urls without channel, no request is spent on them
+    unresolved_rows = [get_result_row(channels[channel_url], channel_url, status, status,
+                                      "error" if status == "error" else "No Data", status)
+                       for channel_url, status in unresolved_channels.items() if status != "retry"]
+
+    if unresolved_rows and not write_rows(unresolved_rows, "skipped"):
+        return "stopped"
+
+    retry_channels += len(unresolved_channels) - len(unresolved_rows)
+    if retry_channels and on_progress:
+        on_progress(retry_channels, "skipped")
+
+    # group the urls by channel id, each channel is fetched and classified once and written on all its urls
+    channel_urls_by_id = {}
+    for channel_url, channel_id in channel_ids.items():
+        channel_urls_by_id.setdefault(channel_id, []).append(channel_url)
+
+    # write first the channels found in the cache, they don't need request nor language detection
+    cached_channels = channel_cache.get_many(channel_urls_by_id) if use_cache else {}
+    metrics.count("cache_hits", len(cached_channels))
+    cached_rows = [get_result_row(channels[channel_url], channel_url, *cached_channels[channel_id])
+                   for channel_id in cached_channels for channel_url in channel_urls_by_id[channel_id]]
+
+    if cached_rows and not write_rows(cached_rows, "cached"):
+        return "stopped"
+
+    # split the channels to process in blocks sent in a single request
+    unique_ids = [channel_id for channel_id in channel_urls_by_id if channel_id not in cached_channels]
+
+    if quota_exceeded:
+        # the urls without channel and the cached channels are written, the others are left for the next run
+        if on_progress:
+            on_progress(sum(len(channel_urls_by_id[channel_id]) for channel_id in unique_ids), "skipped")
+        return "quota"
+    channel_batches = [unique_ids[i:i + CHANNEL_BATCH_SIZE] for i in range(0, len(unique_ids), CHANNEL_BATCH_SIZE)]
+
+    # get the properties of the blocks, results come back in the order of the file
+    for channel_batch, batch_properties, error in channel_fetcher.fetch_in_order(channel_batches, stop_event, columns):
+        if stop_event.is_set():
+            # check state of the event, if the process is stopped, exit the loop
+            return "stopped"
+
+        if error:
+            # Handle quota exceeded error, raised only once all the tokens are exhausted
+            if isinstance(error, QuotaExceededError):
+                return "quota"  # Exit the loop
+
+            print(f"Error processing block of {len(channel_batch)} channels: {str(error)}")
+
+            if RetryPolicy.is_transient(error):
+                # leave the channels of the block for the next run
+                skipped = sum(len(channel_urls_by_id[channel_id]) for channel_id in channel_batch)
+                retry_channels += skipped
+                if on_progress:
+                    on_progress(skipped, "skipped")
+                continue
+
+            # set error for all channels of the block if exception raised
+            batch_properties = {channel_id: ("error", "error", "error") for channel_id in channel_batch}
+
+        # Langauge detection of the whole block in one parallel call, the next blocks are fetched meanwhile
+        # the name of the first url of a channel is used when its description gives no language
+        if l_detector:
+            with metrics.measure("detection"):
+                detected_languages = detect_languages(l_detector, [(channels[channel_urls_by_id[channel_id][0]],
+                                                                    batch_properties[channel_id][1])
+                                                                   for channel_id in channel_batch])
+        else:
+            detected_languages = [None] * len(channel_batch)
+
+        rows = []
+        entries = []
+        for channel_id, col5 in zip(channel_batch, detected_languages):
+            col3, col4, col6 = batch_properties[channel_id]
+            entries.append([channel_id, col3, col4, col5, col6])
+
+            for channel_url in channel_urls_by_id[channel_id]:
+                channel_name = channels[channel_url]
+                rows.append(get_result_row(channel_name, channel_url, col3, col4, col5, col6))
+                print(f"processing {channel_name} - {channel_url}")
+
+        # save the channels found by the api for the next runs, only when all their properties were checked
+        if len(columns) == len(RESULT_COLUMNS):
+            channel_cache.put_many(entry for entry in entries
+                                   if entry[1] != "error" and entry[1:3] != ["No data", "No data"])
+
+        if not write_rows(rows):
+            return "stopped"
+
+    return "retry" if retry_channels else "done"
@@ -0,0 +1,357 @@
+"""Builds exclusion lists from the Results tab with rules, ready to upload in Google Ads
+
+A rule set excludes the channels made for kids, the channels with a topic in a blocked category and the channels
+whose language is not allowed. The rule sets are read from the Rules tab of the file or from a json file, several
+rule sets give several lists, e.g. one per client.
+
+Typical use:
+    python exclusions.py placements.xlsx --rules rules.json --csv exclusions/
+"""
+import os
+import re
+import sys
+import csv
+import json
+import argparse
+import openpyxl
+
+from lingua import IsoCode639_3
+from engine import RESULTS_HEADER, TOPIC_CATEGORIES, TOPIC_TAXONOMY, strip_row, write_sheets
+
+# tab of the rules in the Excel file and its header, a rule set has one row per rule
+RULES_SHEET = "Rules"
+RULES_HEADER = ["Rule set", "Rule", "Value"]
+# rules of a rule set, the blocked categories and allowed languages take one value per row
+RULE_MADE_FOR_KIDS = "Exclude madeForKids"
+RULE_BLOCKED_CATEGORY = "Blocked category"
+RULE_ALLOWED_LANGUAGE = "Allowed language"
+# tab of the exclusion lists and its header, the rule set and the reasons of each excluded channel are kept
+EXCLUSIONS_SHEET = "Exclusions"
+EXCLUSIONS_HEADER = ["Rule set", "Placement", "Placement URL", "Reason"]
+# header of the csv files, one placement url per row as uploaded in a Google Ads exclusion list
+EXCLUSIONS_CSV_HEADER = ["Placement"]
+
+
+class RuleSet:
+    """Rules of an exclusion list
+
+    Methods
+    -------
+    find_exclusions(results)
+        get the excluded channels of the results and the reasons of their exclusion
+    """
+    def __init__(self, name, made_for_kids=False, blocked_categories=(), allowed_languages=()):
+        """
+        Parameters
+        ----------
+        name : str
+            name of the rule set, e.g. the client of the list
+        made_for_kids : bool
+            exclude the channels made for kids
+        blocked_categories : iterable
+            parent categories of TOPIC_TAXONOMY to exclude
+        allowed_languages : iterable
+            ISO 639-3 codes of the languages allowed, empty to allow all languages
+
+        Raises
+        ------
+        ValueError
+            if a category or a language is unknown
+        """
+        self.name = name
+        self.made_for_kids = made_for_kids
+        self.allowed_languages = {code.strip().upper() for code in allowed_languages}
+
+        # the categories are not case-sensitive
+        categories = {category.lower(): category for category in TOPIC_TAXONOMY}
+        blocked_categories = {category.strip() for category in blocked_categories}
+        self.blocked_categories = [categories[category.lower()] for category in sorted(blocked_categories)
+                                   if category.lower() in categories]
+
+        unknown_categories = [category for category in sorted(blocked_categories) if category.lower() not in categories]
+        if unknown_categories:
+            raise ValueError(f"{name}: unknown category {', '.join(unknown_categories)}")
+
+        unknown_languages = [code for code in sorted(self.allowed_languages) if not hasattr(IsoCode639_3, code)]
+        if unknown_languages:
+            raise ValueError(f"{name}: unknown language code {', '.join(unknown_languages)}")
+
+    def find_exclusions(self, results):
+        """Get the excluded channels of the results, each rule is evaluated over a whole column at once
+
+        Parameters
+        ----------
+        results : dict
+            columns of the Results tab {header: values}, as returned by read_results
+
+        Returns
+        -------
+        list
+            [placement, placement_url, reasons] of the excluded channels in the order of the results
+        """
+        # one column of booleans per rule, True when the rule excludes the channel
+        masks = []
+
+        if self.made_for_kids:
+            masks.append(("madeForKids", [value is True for value in results["madeForKids"]]))
+
+        for category in self.blocked_categories:
+            masks.append((category, [value is True for value in get_category_column(results, category)]))
+
+        if self.allowed_languages:
+            # the language is unknown for the channels without description nor name, they are not excluded
+            languages = [str(language).removeprefix("low_") for language in results["Default Language"]]
+            masks.append(("Language", [language not in self.allowed_languages and hasattr(IsoCode639_3, language)
+                                       for language in languages]))
+
+        if not masks:
+            return []
+
+        reasons, columns = zip(*masks)
+        return [[results["Placement"][i], results["Placement URL"][i],
+                 ", ".join(reason for reason, excluded in zip(reasons, row) if excluded)]
+                for i, row in enumerate(zip(*columns)) if any(row)]
+
+
+def get_category_column(results, category):
+    """Get the booleans of a category, computed from the topic for the rows of earlier versions without them
+
+    Parameters
+    ----------
+    results : dict
+        columns of the Results tab {header: values}
+    category : str
+        parent category of TOPIC_TAXONOMY
+    """
+    column = results.get(category) or [None] * len(results["Topic"])
+
+    return [value if value is not None else
+            isinstance(topic, str) and category in {TOPIC_CATEGORIES.get(label) for label in topic.split(", ")}
+            for value, topic in zip(column, results["Topic"])]
+
+
+def parse_rule_sets(rows):
+    """Parses the rows of the Rules tab
+
+    Parameters
+    ----------
+    rows : iterable
+        (rule set, rule, value) of each rule, a rule set without name is named after the Exclusions tab
+
+    Returns
+    -------
+    list
+        RuleSet in the order they appear
+
+    Raises
+    ------
+    ValueError
+        if a rule, a category or a language is unknown
+    """
+    rules = {}
+
+    for row in rows:
+        name, rule, value = (list(row) + [None] * 3)[:3]
+        if rule is None:
+            continue
+        rule_set = rules.setdefault(str(name or EXCLUSIONS_SHEET), {"made_for_kids": False, "blocked_categories": [],
+                                                                   "allowed_languages": []})
+
+        if rule == RULE_MADE_FOR_KIDS:
+            rule_set["made_for_kids"] = value is True or str(value).strip().lower() in ("true", "yes", "1")
+        elif rule == RULE_BLOCKED_CATEGORY:
+            rule_set["blocked_categories"].append(str(value))
+        elif rule == RULE_ALLOWED_LANGUAGE:
+            rule_set["allowed_languages"].append(str(value))
+        else:
+            raise ValueError(f"Unknown rule: {rule}")
+
+    return [RuleSet(name, **rule_set) for name, rule_set in rules.items()]
+
+
+def load_rule_sets(path):
+    """Loads the rule sets of the Rules tab of an Excel file, or of a json file
+
+    The json file maps the name of each rule set to its rules:
+        {"Client A": {"made_for_kids": true, "blocked_categories": ["Gaming"], "allowed_languages": ["ENG", "FRA"]}}
+
+    Parameters
+    ----------
+    path : str
+        path of the Excel or json file
+
+    Returns
+    -------
+    list
+        RuleSet of the file, empty if the Excel file has no Rules tab
+
+    Raises
+    ------
+    ValueError
+        if a rule, a category or a language is unknown
+    """
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as file:
+            rule_sets = json.load(file)
+        try:
+            return [RuleSet(name, **rules) for name, rules in rule_sets.items()]
+        except TypeError as e:
+            # a key of a rule set is not an argument of RuleSet
+            raise ValueError(f"Unknown rule in {os.path.basename(path)}: {str(e)}")
+
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        if RULES_SHEET not in workbook.sheetnames:
+            return []
+        rows = workbook[RULES_SHEET].iter_rows(values_only=True)
+        if RULES_HEADER != strip_row(next(rows, ())):
+            raise ValueError(f"{RULES_SHEET} tab incorrect, its header must be {', '.join(RULES_HEADER)}")
+        return parse_rule_sets(rows)
+    finally:
+        workbook.close()
+
+
+def read_results(path):
+    """Reads the Results tab of the file by columns
+
+    Parameters
+    ----------
+    path : str
+        path of the Excel file
+
+    Returns
+    -------
+    dict
+        {header: values} of each column of RESULTS_HEADER, the columns missing from files of earlier versions are
+        filled with None
+    """
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        if "Results" not in workbook.sheetnames:
+            return {header: [] for header in RESULTS_HEADER}
+
+        rows = workbook["Results"].iter_rows(values_only=True)
+        header = strip_row(next(rows, ()))
+        # pad the short rows so every column has a value per row
+        columns = list(zip(*(tuple(row) + (None,) * (len(header) - len(row)) for row in rows)))
+    finally:
+        workbook.close()
+
+    results = {name: list(values) for name, values in zip(header, columns)}
+    length = len(columns[0]) if columns else 0
+    return {name: results.get(name) or [None] * length for name in RESULTS_HEADER}
+
+
+def write_exclusions(path, exclusions, csv_directory=None):
+    """Writes the exclusion lists in the Exclusions tab of the file, and in a csv file per rule set
+
+    The Exclusions tab is replaced, the other tabs are copied unchanged with their formatting.
+
+    Parameters
+    ----------
+    path : str
+        path of the Excel file
+    exclusions : dict
+        {rule set name: [placement, placement_url, reasons]} of the excluded channels
+    csv_directory : str
+        directory of the csv files, no csv file is written if None
+
+    Returns
+    -------
+    list
+        paths of the csv files written
+    """
+    write_sheets(path, {EXCLUSIONS_SHEET: [EXCLUSIONS_HEADER, *([name, *row] for name, rows in exclusions.items()
+                                                                for row in rows)]})
+
+    csv_paths = []
+    if csv_directory is not None:
+        os.makedirs(csv_directory, exist_ok=True)
+        file_name = os.path.splitext(os.path.basename(path))[0]
+
+        for name, rows in exclusions.items():
+            # keep the name of the rule set in the file name without the characters forbidden in paths
+            csv_name = re.sub(r"[^\w-]+", "_", name)
+            csv_path = os.path.join(csv_directory, f"{file_name}_{csv_name}.csv")
+            with open(csv_path, "w", newline="", encoding="utf-8") as file:
+                writer = csv.writer(file)
+                writer.writerow(EXCLUSIONS_CSV_HEADER)
+                writer.writerows([row[1]] for row in rows)
+            csv_paths.append(csv_path)
+
+    return csv_paths
+
+
+def build_exclusions(path, rule_sets=None, csv_directory=None):
+    """Applies the rule sets to the Results tab of the file and writes the exclusion lists
+
+    Parameters
+    ----------
+    path : str
+        path of the Excel file
+    rule_sets : list
+        RuleSet to apply, default to the Rules tab of the file
+    csv_directory : str
+        directory of the csv files, no csv file is written if None
+
+    Returns
+    -------
+    dict
+        number of channels excluded by each rule set, empty if there is no rule
+
+    Raises
+    ------
+    ValueError
+        if a rule of the Rules tab is invalid
+    """
+    if rule_sets is None:
+        rule_sets = load_rule_sets(path)
+    if not rule_sets:
+        return {}
+
+    results = read_results(path)
+    exclusions = {rule_set.name: rule_set.find_exclusions(results) for rule_set in rule_sets}
+    write_exclusions(path, exclusions, csv_directory)
+
+    return {name: len(rows) for name, rows in exclusions.items()}
+
+
+def main(argv=None):
+    """Builds the exclusion lists of the files given in the command line
+
+    Parameters
+    ----------
+    argv : list
+        arguments to parse, default to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Build the exclusion lists of processed files with rules.")
+    parser.add_argument("files", nargs="+", help="Excel files with a Results tab")
+    parser.add_argument("--rules", help="json or Excel file with the rule sets (default to the Rules tab of each file)")
+    parser.add_argument("--csv", help="directory where a csv file is written per file and rule set")
+    arguments = parser.parse_args(argv)
+
+    try:
+        rule_sets = load_rule_sets(arguments.rules) if arguments.rules else None
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+    exit_code = 0
+    for path in arguments.files:
+        try:
+            excluded = build_exclusions(path, rule_sets, arguments.csv)
+        except (ValueError, OSError) as e:
+            print(f"{path}: {str(e)}", file=sys.stderr)
+            exit_code = 1
+            continue
+
+        if not excluded:
+            print(f"{path}: no rule, add a {RULES_SHEET} tab or use --rules", file=sys.stderr)
+            exit_code = 1
+        for name, count in excluded.items():
+            print(f"{path}: {count} channels excluded by {name}", file=sys.stderr)
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,19 @@
 import time
-import openpyxl
+import queue
+import threading
 import tkinter as tk
 
 from tkinter import ttk, filedialog, PhotoImage, messagebox
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from lingua import LanguageDetectorBuilder
+from engine import (DEFAULT_FETCH_WORKERS, MAX_FETCH_WORKERS, DEFAULT_CACHE_TTL_DAYS, DEFAULT_REFRESH_DAYS,
+                    RESULT_COLUMNS, TemplateError, QuotaScheduler, ResultsFile, RunMetrics, SharedResultsFile,
+                    ThroughputEstimator, check_channels, count_unique_channels, find_invalid_api_keys, load_channels,
+                    parse_languages)
+from exclusions import build_exclusions
+
+# delay in milliseconds between two checks of the worker progress by the interface
+PROGRESS_POLL_INTERVAL = 100
+# delay in milliseconds between two updates of the time left and of the stats, the throughput is sampled at this rate
+ETA_UPDATE_INTERVAL = 1000
 
 
 class MainApp(tk.Tk):
@@ -19,41 +27,91 @@ class MainApp(tk.Tk):
         the title of the application displayed at the top of the window
     resizable : tkinter.Wm
         control the possibility to resize the app window on the x and y axes
-    excel_file_path : tkinter.StringVar()
-        contain the path of the uploaded file
+    excel_file_paths : list
+        contain the paths of the uploaded files
+    use_cache : tkinter.BooleanVar()
+        indicate if the channels already in the local cache are read from it instead of the api
+    low_accuracy : tkinter.BooleanVar()
+        indicate if the language detection uses the faster low accuracy mode
+    checked_columns : dict
+        tkinter.BooleanVar() of each column of the results, indicate if the column is requested to the api
+    refresh : tkinter.BooleanVar()
+        indicate if the old results, the errors and the channels without data are checked again
+    refresh_days : int
+        age in days of the results checked again when the files were verified, None when they are not checked again
     icon_image : tkinter.PhotoImage
         excel icon stored in base 64 displayed next to the file name
-    api_key : str
-        define the validity of the user's token
+    api_keys : list
+        tokens entered by the user, verified by the worker before the channels are checked
+    quota_scheduler : QuotaScheduler
+        share the daily quota of the tokens during the process
     channel_number : int
         count the number of channel to process on the uploaded file
+    unique_channel_number : int
+        count the channels to process once their urls are canonicalized
     channel : dict
-        dictionary of extracted data from Excel file in data tab {channel_url:channel_name}
+        dictionary of the channels to process of all the uploaded files {channel_url:channel_name}
     processed_channel_number : int
         count the channels already processed
-    processed_channel : dict
-        dictionary of extracted data from Excel file in results tab {channel_url:channel_name}
-    workbook : openpyxl.reader.excel
-        loaded Excel file
-    stop_and_save_state : bool
+    processed_channel : set
+        urls of the channels already in the results tab of the uploaded files
+    results_file : SharedResultsFile
+        Excel files where the results of their channels are appended
+    stop_and_save_state : threading.Event
         indicate when the button 'Stop & Save' is used
+    progress_queue : queue.Queue
+        messages sent by the processing and saving workers to the interface (event, value)
+    workbook_lock : threading.Lock
+        prevent the worker to write in the results file while it is saved
+    throughput_estimator : ThroughputEstimator
+        estimate the time left of the current process from its throughput
+    last_eta_update : float
+        time at which the time left was last updated
+    processed_iteration : int
+        count the channels processed by the worker during the current process
+    run_metrics : RunMetrics
+        durations of the stages and counters of the current or last process, shown in the Stats tab
 
     Methods
     -------
     browse_file()
-        ask user to upload file and update interface
+        ask user to upload files and update interface
     help_window()
         display help instructions
     process_channels()
         start the process to check channels and update interface
+    get_workers()
+        read the number of parallel requests chosen by the user
+    get_cache_ttl()
+        read the number of days the cached channels are valid
+    get_refresh_days()
+        read the age in days of the results checked again
+    reload_files()
+        verify the uploaded files again and update interface
     stop_and_save()
         stop process from user action
-    is_valid_youtube_token()
-        check if user's token is valid
+    read_api_keys()
+        read the user's tokens from the api entry
     verify_excel_template()
-        verifies if uploaded file is conform to template
-    youtube_checker()
-        processes channels
+        verifies if uploaded files are conform to template
+    youtube_checker(quota_scheduler, settings, stop_event, progress_queue)
+        processes channels in a background worker
+    check_progress()
+        update interface with the worker progress and save result when process is over
+    update_stats()
+        display the metrics of the process in the Stats tab
+    export_report()
+        ask user where to write the metrics of the process
+    save_results(message)
+        save collected data in file in a background worker
+    save_worker(results_file, message, metrics, progress_queue)
+        save the files and build their exclusion lists in a background worker
+    check_saved()
+        inform the user and reset the app once the files are saved
+    cancel_process(message)
+        give the interface back when the process can't start
+    enable_settings()
+        enable the settings disabled during the process
     end_process()
         reset the app
     """
@@ -63,7 +121,8 @@ class MainApp(tk.Tk):
 
         self.title("YouTube Made For Kid Checker")
         self.resizable(False, False)
-        self.excel_file_path = tk.StringVar()
+        self.excel_file_paths = []
+        self.refresh_days = None
         self.icon_image = PhotoImage(data=('iVBORw0KGgoAAAANSUhEUgAAAB4AAAAeCAYAAAA7MK6iAAAACXBIWXMAAAsTAAALEwEAmpw'
                                            'YAAAB+ElEQVR4nGNgGAWDCQj3h6qLTQpywYc191U6ax6ud8GJD9Wak2SpyORwNbEJwX/EJo'
                                            'b8x4c1DtY+1jxU/x8vPlyfRLTF4v3BDoQsJdrig/UNoxaDACNvvpUld4GFCzLmr3EqFu7w/'
@@ -75,13 +134,21 @@ class MainApp(tk.Tk):
                                            'EvhfptqV9j7mIQJTxWIeEotM3jyzn+JuWsdgWLTDe49Ir98xfFii3aeQ+Eoi3rhYNFjvPzo'
                                            'W99H+L+GhBcdqqXaP1dPs/+PFqfYk1Mfu2g7IFuDCoxarUxrUUp4aahLuWn+oEtRp9olEWw'
                                            'yzXMxd0wUfVkuycVZNtXfBidNtzUiydBQwUAkAAEux+AOOo/0gAAAAAElFTkSuQmCC'))
-        self.api_key = "empty"
+        self.api_keys = []
+        self.quota_scheduler = None
         self.channel_number = 0
+        self.unique_channel_number = 0
         self.channel = {}
         self.processed_channel_number = 0
-        self.processed_channel = {}
-        self.workbook = None
-        self.stop_and_save_state = False
+        self.processed_channel = set()
+        self.results_file = None
+        self.stop_and_save_state = threading.Event()
+        self.progress_queue = queue.Queue()
+        self.workbook_lock = threading.Lock()
+        self.throughput_estimator = None
+        self.last_eta_update = 0
+        self.processed_iteration = 0
+        self.run_metrics = None
 
         self.frame_main = Container(self, column_number=0, row_number=0)
 
@@ -101,17 +168,18 @@ class MainApp(tk.Tk):
 
         self.charging_bar = ChargingBar(self.tab1_container)
 
-        self.btn_upload = ttk.Button(self.tab1_container, text=f"Upload excel file", command=self.browse_file)
+        self.btn_upload = ttk.Button(self.tab1_container, text=f"Upload excel files", command=self.browse_file)
         self.btn_upload.grid(row=3, column=2)
 
         self.btn_process = ttk.Button(self.tab1_container, text=f"Process channels", command=self.process_channels, state=tk.DISABLED)
         self.btn_process.grid(row=3, column=1, padx=5)
 
         # tab2
-        self.tab2_container = Container(self.notebook, column_number=(0, 1), row_number=(0, 1, 2), uniform_type='a')
+        self.tab2_container = Container(self.notebook, column_number=(0, 1), row_number=(0, 1, 2, 3, 4, 5, 6),
+                                        uniform_type='a')
         self.notebook.add(self.tab2_container, text="API Token")
 
-        self.lbl_entry_title = ttk.Label(self.tab2_container, text="Enter valid Youtube API token:")
+        self.lbl_entry_title = ttk.Label(self.tab2_container, text="Enter valid Youtube API tokens separated by commas:")
         self.lbl_entry_title.grid(row=0, column=0, columnspan=2)
 
         self.api_entry = ttk.Entry(self.tab2_container, width=39)
@@ -120,32 +188,131 @@ class MainApp(tk.Tk):
         self.btn_help = ttk.Button(self.tab2_container, text="How to get a token ?", command=self.help_window)
         self.btn_help.grid(row=2, column=1)
 
+        self.frame_workers = ttk.Frame(self.tab2_container)
+        self.frame_workers.grid(row=2, column=0)
+
+        self.lbl_workers = ttk.Label(self.frame_workers, text="Parallel requests:")
+        self.lbl_workers.pack(side=tk.LEFT)
+
+        self.spn_workers = ttk.Spinbox(self.frame_workers, from_=1, to=MAX_FETCH_WORKERS, width=3)
+        self.spn_workers.set(DEFAULT_FETCH_WORKERS)
+        self.spn_workers.pack(side=tk.LEFT, padx=5)
+
+        self.use_cache = tk.BooleanVar(value=True)
+        self.chk_cache = ttk.Checkbutton(self.tab2_container, text="Use cached channels", variable=self.use_cache)
+        self.chk_cache.grid(row=3, column=0)
+
+        self.frame_cache = ttk.Frame(self.tab2_container)
+        self.frame_cache.grid(row=3, column=1)
+
+        self.lbl_cache_ttl = ttk.Label(self.frame_cache, text="Cache expires after (days):")
+        self.lbl_cache_ttl.pack(side=tk.LEFT)
+
+        self.spn_cache_ttl = ttk.Spinbox(self.frame_cache, from_=0, to=365, width=3)
+        self.spn_cache_ttl.set(DEFAULT_CACHE_TTL_DAYS)
+        self.spn_cache_ttl.pack(side=tk.LEFT, padx=5)
+
+        self.frame_languages = ttk.Frame(self.tab2_container)
+        self.frame_languages.grid(row=4, column=0)
+
+        self.lbl_languages = ttk.Label(self.frame_languages, text="Languages (e.g. eng, fra):")
+        self.lbl_languages.pack(side=tk.LEFT)
+
+        self.languages_entry = ttk.Entry(self.frame_languages, width=12)
+        self.languages_entry.pack(side=tk.LEFT, padx=5)
+
+        self.low_accuracy = tk.BooleanVar(value=False)
+        self.chk_low_accuracy = ttk.Checkbutton(self.tab2_container, text="Fast language detection",
+                                                variable=self.low_accuracy)
+        self.chk_low_accuracy.grid(row=4, column=1)
+
+        self.frame_columns = ttk.Frame(self.tab2_container)
+        self.frame_columns.grid(row=5, column=0, columnspan=2)
+
+        self.lbl_columns = ttk.Label(self.frame_columns, text="Check:")
+        self.lbl_columns.pack(side=tk.LEFT)
+
+        # the language is detected from the description
+        self.checked_columns = {column: tk.BooleanVar(value=True) for column in RESULT_COLUMNS}
+        self.chk_columns = []
+        for column, text in zip(RESULT_COLUMNS, ["madeForKids", "Description & Language", "Topic"]):
+            chk_column = ttk.Checkbutton(self.frame_columns, text=text, variable=self.checked_columns[column])
+            chk_column.pack(side=tk.LEFT, padx=5)
+            self.chk_columns.append(chk_column)
+
+        # the files are verified again when the process starts if these settings changed
+        self.refresh = tk.BooleanVar(value=False)
+        self.chk_refresh = ttk.Checkbutton(self.tab2_container, text="Refresh old results", variable=self.refresh)
+        self.chk_refresh.grid(row=6, column=0)
+
+        self.frame_refresh = ttk.Frame(self.tab2_container)
+        self.frame_refresh.grid(row=6, column=1)
+
+        self.lbl_refresh_days = ttk.Label(self.frame_refresh, text="Results expire after (days):")
+        self.lbl_refresh_days.pack(side=tk.LEFT)
+
+        self.spn_refresh_days = ttk.Spinbox(self.frame_refresh, from_=0, to=365, width=3)
+        self.spn_refresh_days.set(DEFAULT_REFRESH_DAYS)
+        self.spn_refresh_days.pack(side=tk.LEFT, padx=5)
+
+        # tab3
+        self.tab3_container = Container(self.notebook, column_number=0, row_number=(0, 1))
+        self.notebook.add(self.tab3_container, text="Stats")
+
+        self.lbl_stats = ttk.Label(self.tab3_container, text="No process started", anchor=tk.CENTER,
+                                   justify=tk.LEFT, font=("Courier", 10))
+        self.lbl_stats.grid(row=0, column=0, sticky="nswe", padx=10)
+
+        self.btn_export = ttk.Button(self.tab3_container, text="Export report", command=self.export_report,
+                                     state=tk.DISABLED)
+        self.btn_export.grid(row=1, column=0)
+
     def browse_file(self):
-        """The browsing function will prompt the user to select and upload file.
+        """The browsing function will prompt the user to select and upload files.
 
-        The file uploaded will be set to an attribute and verified by external function.
-        If the file is valid, it will be displayed on the interface and the user will have the possibility to process it.
+        The files uploaded will be set to an attribute and verified by external function.
+        If the files are valid, they will be displayed on the interface and the user will have the possibility to
+        process them. The channels of several files are processed together, a channel found in several files is
+        checked once.
 
         Only .xlsx file are allow as we are working with openpyxl.
         """
-        filepath = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx")])
-        if filepath:
-            # if file was provided set the file path and verify if the file match the template
-            self.excel_file_path.set(filepath)
-            if self.verify_excel_template():
-                # if the file is valid, display file name and icon
-                self.lbl_file_uploaded.config(text=filepath.split('/')[-1], image=self.icon_image, compound='left')
-                self.lbl_yb_channel_count.config(text=f'{self.channel_number} channels')
-                # activate the process button
-                self.btn_process.config(state=tk.NORMAL)
-            else:
-                # It's only useful when a first valid file is uploaded and a second invalid file is uploaded
-                # Reset the label text and image
-                self.lbl_file_uploaded.config(text="No file uploaded", image="")
-                # Reset channel counter
-                self.lbl_yb_channel_count.config(text="")
-                # Rest process button
-                self.btn_process.config(state=tk.DISABLED)
+        filepaths = filedialog.askopenfilenames(filetypes=[("Excel files", "*.xlsx")])
+        if filepaths:
+            # if files were provided set the file paths and verify if the files match the template
+            self.excel_file_paths = list(filepaths)
+            self.reload_files()
+
+    def reload_files(self):
+        """Verify the uploaded files and update the interface, called on upload and on start when the refresh changed
+
+        Returns
+        -------
+        bool
+            True if at least one file can be processed
+        """
+        if not self.excel_file_paths:
+            return False
+
+        if self.verify_excel_template():
+            # if the files are valid, display file name and icon
+            file_text = (self.excel_file_paths[0].split('/')[-1] if len(self.excel_file_paths) == 1
+                         else f"{len(self.excel_file_paths)} files")
+            self.lbl_file_uploaded.config(text=file_text, image=self.icon_image, compound='left')
+            self.lbl_yb_channel_count.config(text=f'{self.channel_number} channels\n'
+                                                 f'{self.unique_channel_number} unique')
+            # activate the process button
+            self.btn_process.config(state=tk.NORMAL)
+            return True
+        else:
+            # It's only useful when a first valid file is uploaded and a second invalid file is uploaded
+            # Reset the label text and image
+            self.lbl_file_uploaded.config(text="No file uploaded", image="")
+            # Reset channel counter
+            self.lbl_yb_channel_count.config(text="")
+            # Rest process button
+            self.btn_process.config(state=tk.DISABLED)
+            return False
 
     def help_window(self):
         """This function will call an instance of the HelpWindow class and show the instruction how to get a token."""
@@ -153,110 +320,198 @@ class MainApp(tk.Tk):
 
     def process_channels(self):
         """Logic structure used when 'process channel' button is triggerd.
-        The token validity will be first verified.
-        If the token is valid:
+        The tokens will be first read, they are verified by the worker so the interface doesn't wait for the requests.
+        If tokens were entered:
             The upload button and the api entry will be disabled to avoid any conflicting changes during the process.
             The charging bar and the save&quit feature will be shown.
             The function to process the channels will start.
         """
-        self.is_valid_youtube_token()  # initiate verification of api toke
-
-        # display error message box if token is invalid or empty
-        if self.api_key == "invalid":
-            messagebox.showinfo(title="Message Box", message="Token invalid", icon='error')
-        elif self.api_key == "empty":
+        # the refresh settings changed since the files were verified, find the rows to check again
+        if self.get_refresh_days() != self.refresh_days and not self.reload_files():
+            return
+
+        self.read_api_keys()
+
+        try:
+            # languages the detection is restricted to, all languages when the entry is empty
+            languages = parse_languages(self.languages_entry.get())
+        except ValueError as e:
+            messagebox.showinfo(title="Message Box", message=str(e), icon='error')
+            return
+
+        # columns requested to the api, the others are left empty
+        columns = tuple(column for column, checked in self.checked_columns.items() if checked.get())
+        if not columns:
+            messagebox.showinfo(title="Message Box", message="Check at least one column", icon='error')
+            return
+
+        # display error message box if token is empty
+        if not self.api_keys:
             messagebox.showinfo(title="Message Box", message="Token empty", icon='error')
         else:
-            # when token is valid, disable token entry and upload button to avoid any changes during process
+            # when tokens were entered, disable token entry and upload button to avoid any changes during process
             self.api_entry.config(state=tk.DISABLED)
+            self.spn_workers.config(state=tk.DISABLED)
+            self.chk_cache.config(state=tk.DISABLED)
+            self.spn_cache_ttl.config(state=tk.DISABLED)
+            self.languages_entry.config(state=tk.DISABLED)
+            self.chk_low_accuracy.config(state=tk.DISABLED)
+            for chk_column in self.chk_columns:
+                chk_column.config(state=tk.DISABLED)
+            self.chk_refresh.config(state=tk.DISABLED)
+            self.spn_refresh_days.config(state=tk.DISABLED)
             self.btn_upload.config(state=tk.DISABLED)
             # display the charging bar use to show progress
             self.charging_bar.show_bar()
             # alter process channel button to have Stop & Save feature
             self.btn_process.config(text="Stop & Save", command=self.stop_and_save)
-            # start processing channels
-            self.youtube_checker()
+            # Set the total steps of the charging bar
+            self.charging_bar['maximum'] = self.channel_number
+            # start processing channels in a background worker and follow its progress from the main loop
+            self.throughput_estimator = ThroughputEstimator(self.channel_number)
+            self.last_eta_update = time.monotonic()
+            self.processed_iteration = 0
+            # share the daily quota of all tokens, the next token is used when one is exhausted
+            self.quota_scheduler = QuotaScheduler(self.api_keys)
+            self.run_metrics = RunMetrics()
+            self.btn_export.config(state=tk.NORMAL)
+            # on a refresh the cache must not give back channels older than the rows checked again
+            cache_ttl = self.get_cache_ttl() if self.refresh_days is None else min(self.get_cache_ttl(),
+                                                                                   self.refresh_days)
+            settings = {"workers": self.get_workers(), "use_cache": self.use_cache.get(),
+                        "cache_ttl": cache_ttl, "languages": languages,
+                        "low_accuracy": self.low_accuracy.get(), "columns": columns, "metrics": self.run_metrics}
+            threading.Thread(target=self.youtube_checker,
+                             args=(self.quota_scheduler, settings, self.stop_and_save_state, self.progress_queue),
+                             daemon=True).start()
+            self.after(PROGRESS_POLL_INTERVAL, self.check_progress)
+
+    def get_workers(self):
+        """Read the number of parallel requests from the spinbox, fall back to default value if the input is invalid"""
+        try:
+            return min(max(int(self.spn_workers.get()), 1), MAX_FETCH_WORKERS)
+        except ValueError:
+            return DEFAULT_FETCH_WORKERS
+
+    def get_cache_ttl(self):
+        """Read the number of days the cached channels are valid, fall back to default value if the input is invalid"""
+        try:
+            return max(int(self.spn_cache_ttl.get()), 0)
+        except ValueError:
+            return DEFAULT_CACHE_TTL_DAYS
+
+    def get_refresh_days(self):
+        """Read the age in days of the results checked again, None without refresh, default value if input is invalid"""
+        if not self.refresh.get():
+            return None
+        try:
+            return max(int(self.spn_refresh_days.get()), 0)
+        except ValueError:
+            return DEFAULT_REFRESH_DAYS
 
     def stop_and_save(self):
-        """Change the state of the attribute stop_and_save_state in order to exit the processing channel loop."""
-        self.stop_and_save_state = True
+        """Change the state of the attribute stop_and_save_state in order to exit the processing channel loop.
 
-    def is_valid_youtube_token(self):
-        """Verify the validity of the token by sending a request to the Google api under a try statement."""
-        if self.api_entry.get():
-            # if there is text in api entry
-            try:
-                # try to send request to api with token provided
-                youtube = build('youtube', 'v3', developerKey=self.api_entry.get())
-                youtube.videos().list(part='id', id='VIDEO_ID').execute()
-                # set api key to valid if the request is successful
-                self.api_key = "valid"
+        The results are saved right away, the worker drops the request in flight when it sees the event.
+        """
+        self.stop_and_save_state.set()
 
-            except HttpError:
-                # if it catches an error the token is not valid
-                self.api_key = "invalid"
+    def read_api_keys(self):
+        """Read the user's tokens from the api entry, they are verified by youtube_checker off the Tk thread.
+
+        The tokens are separated by commas in the api entry, duplicates are ignored.
+        """
+        self.api_keys = list(dict.fromkeys(key.strip() for key in self.api_entry.get().split(",") if key.strip()))
 
     def verify_excel_template(self):
-        """Verifies if the file uploaded is matching the template, count and save channels from the file"""
-        # load the file
-        self.workbook = openpyxl.load_workbook(self.excel_file_path.get())
+        """Verifies if the files uploaded are matching the template, count and save channels from the files
 
+        The files not matching the template are left aside, the others are processed.
+        """
         # reset attributes for the case when user change the uploaded file
         self.channel_number = 0
+        self.unique_channel_number = 0
         self.channel = {}
         self.processed_channel_number = 0
-        self.processed_channel = {}
-
-        if "Data" in self.workbook.sheetnames and ["Placement", "Placement URL"] == [cell.value for cell in
-                                                                                     self.workbook["Data"][1]]:
-            # get the number of channel to process
-            for row in self.workbook["Data"].iter_rows(min_row=2, values_only=True):
-                self.channel[row[1]] = row[0]
-
-            self.channel_number = len(self.channel)
-
-            # if there is no channel to process rise error
-            if not self.channel_number:
-                messagebox.showinfo(title="Message Box", message="Empty file", icon='error')
-                return False
-
-            # if there is a result tab, check the header
-            elif "Results" in self.workbook.sheetnames and ["Placement",
-                                                                    "Placement URL",
-                                                                    "madeForKids",
-                                                                    "Description",
-                                                                    "Default Language",
-                                                                    "Topic"] == [cell.value for cell in
-                                                                                 self.workbook["Results"][1]]:
-                # get the number of processed channels
-                for row in self.workbook["Results"].iter_rows(min_row=2, values_only=True):
-                    self.processed_channel[row[1]] = row[0]
-
-                self.processed_channel_number = len(self.processed_channel)
-                # adjust the number of channels to process
-                self.channel_number = len({k: v for k, v in self.channel.items() if k not in self.processed_channel})
-                # if the channels are already processed rise error
-                if not self.channel_number:
-                    messagebox.showinfo(title="Message Box", message="Channels already processed", icon='error')
-                    return False
-
-                return True
+        self.processed_channel = set()
+        self.results_file = SharedResultsFile()
+        self.refresh_days = self.get_refresh_days()
+        errors = []
 
-            return True
-        else:
-            # return False and display error message box when template invalid
-            messagebox.showinfo(title="Message Box", message="Template file incorrect", icon='error')
+        for path in self.excel_file_paths:
+            try:
+                # on a refresh the old results, the errors and the channels without data are processed again
+                channels, processed_channels = load_channels(path, refresh_days=self.refresh_days)
+            except TemplateError as e:
+                errors.append((path.split('/')[-1], str(e)))
+                continue
+
+            self.processed_channel.update(processed_channels)
+            self.results_file.add(ResultsFile(path), {k: v for k, v in channels.items() if k not in processed_channels})
+
+        if not self.results_file.results_files:
+            # return False and display error message box when templates invalid, files empty or already processed
+            message = errors[0][1] if len(errors) == 1 else "\n".join(f"{name}: {error}" for name, error in errors)
+            messagebox.showinfo(title="Message Box", message=message, icon='error')
+            self.results_file = None
             return False
 
-    def youtube_checker(self):
-        """Main function to process the channels in the uploaded file"""
-        def calculation_process_time(start_time, current_iter, max_iter):
-            """Calculates an estimation of the time left to process all channels with basic math"""
-            t_elapsed = time.time() - start_time
-            t_estimated = (t_elapsed / current_iter) * max_iter
-            time_left = t_estimated - t_elapsed
+        if errors:
+            messagebox.showinfo(title="Message Box", icon='warning', message="Files left aside:\n" + "\n".join(
+                f"{name}: {error}" for name, error in errors))
 
-            if time_left >= 2 * 3600:  # 2 hours or more
+        # get the number of channels to process, a url found in several files is counted once
+        self.channel = self.results_file.channels()
+        self.processed_channel_number = len(self.processed_channel)
+        self.channel_number = len(self.channel)
+        self.unique_channel_number = count_unique_channels(self.channel)
+        return True
+
+    def youtube_checker(self, quota_scheduler, settings, stop_event, progress_queue):
+        """Main function to process the channels in the uploaded file
+
+        Runs the engine in a background thread: it never touches the widgets and reports to the interface through the
+        progress_queue with ("invalid", positions of the invalid tokens), ("progress", (number of channels, kind)),
+        ("quota", None), ("done", None), ("retry", None) and ("error", message) messages.
+        The tokens are verified first, concurrently, the tokens out of quota for today are valid and left aside.
+
+        Parameters
+        ----------
+        quota_scheduler : QuotaScheduler
+            scheduler of the tokens read from the api entry before the worker started
+        settings : dict
+            keyword arguments of engine.check_channels read from the interface
+        stop_event : threading.Event
+            event of the process, set when the user stops it or when the results are saved
+        progress_queue : queue.Queue
+            queue of the process read by the interface
+        """
+        try:
+            invalid_keys = find_invalid_api_keys(quota_scheduler.api_keys, quota_scheduler)
+            if invalid_keys:
+                progress_queue.put(("invalid", invalid_keys))
+                return
+
+            # the channels already processed were left aside by verify_excel_template
+            status = check_channels(self.channel, self.results_file, quota_scheduler, stop_event=stop_event,
+                                    results_lock=self.workbook_lock,
+                                    on_progress=lambda count, kind: progress_queue.put(("progress", (count, kind))),
+                                    **settings)
+        except Exception as e:
+            print(f"Error during the process: {str(e)}")
+            progress_queue.put(("error", str(e)))
+            return
+
+        if status != "stopped":
+            progress_queue.put((status, None))
+
+    def check_progress(self):
+        """Update the interface with the messages of the worker, called periodically from the Tk main loop"""
+        def format_time_left(time_left):
+            """Formats the estimation of the time left to process all channels"""
+            if time_left is None:  # no block fetched yet
+                return 'Estimating time left'
+            elif time_left >= 2 * 3600:  # 2 hours or more
                 return f'{round(time_left / 3600)} hours left'
             elif time_left >= 3600:  # 1 hour or more
                 return f'{round(time_left / 3600)} hour left'
@@ -267,158 +522,200 @@ class MainApp(tk.Tk):
             else:  # less than 1 minute
                 return f'{round(time_left)} seconds left'
 
-        def get_youtube_api_service(api_key):
-            """Sets the header of api request with correct service, version and user token"""
-            api_service_name = "youtube"
-            api_version = "v3"
-            return build(api_service_name, api_version, developerKey=api_key)
-
-        def get_channel_properties(api_service, channel_url):
-            """Gets channel properties"""
-            topic_id = {"/m/04rlf": "Music (parent topic)", "/m/02mscn": "Christian music",
-                        "/m/0ggq0m": "Classical music", "/m/01lyv": "Country", "/m/02lkt": "Electronic music",
-                        "/m/0glt670": "Hip hop music", "/m/05rwpb": "Independent music", "/m/03_d0": "Jazz",
-                        "/m/028sqc": "Music of Asia", "/m/0g293": "Music of Latin America", "/m/064t9": "Pop music",
-                        "/m/06cqb": "Reggae", "/m/06j6l": "Rhythm and blues", "/m/06by7": "Rock music",
-                        "/m/0gywn": "Soul music", "/m/0bzvm2": "Gaming (parent topic)", "/m/025zzc": "Action game",
-                        "/m/02ntfj": "Action-adventure game", "/m/0b1vjn": "Casual game",
-                        "/m/02hygl": "Music video game", "/m/04q1x3q": "Puzzle video game",
-                        "/m/01sjng": "Racing video game", "/m/0403l3g": "Role-playing video game",
-                        "/m/021bp2": "Simulation video game", "/m/022dc6": "Sports game",
-                        "/m/03hf_rm": "Strategy video game", "/m/06ntj": "Sports (parent topic)",
-                        "/m/0jm_": "American football", "/m/018jz": "Baseball", "/m/018w8": "Basketball",
-                        "/m/01cgz": "Boxing", "/m/09xp_": "Cricket", "/m/02vx4": "Football", "/m/037hz": "Golf",
-                        "/m/03tmr": "Ice hockey", "/m/01h7lh": "Mixed martial arts", "/m/0410tth": "Motorsport",
-                        "/m/07bs0": "Tennis", "/m/07_53": "Volleyball", "/m/02jjt": "Entertainment (parent topic)",
-                        "/m/09kqc": "Humor", "/m/02vxn": "Movies", "/m/05qjc": "Performing arts",
-                        "/m/066wd": "Professional wrestling", "/m/0f2f9": "TV shows",
-                        "/m/019_rr": "Lifestyle (parent topic)", "/m/032tl": "Fashion", "/m/027x7n": "Fitness",
-                        "/m/02wbm": "Food", "/m/03glg": "Hobby", "/m/068hy": "Pets",
-                        "/m/041xxh": "Physical attractiveness [Beauty]", "/m/07c1v": "Technology",
-                        "/m/07bxq": "Tourism", "/m/07yv9": "Vehicles", "/m/098wr": "Society (parent topic)",
-                        "/m/09s1f": "Business", "/m/0kt51": "Health", "/m/01h6rj": "Military", "/m/05qt0": "Politics",
-                        "/m/06bvp": "Religion", "/m/01k8wb": "Knowledge", '/g/120yrv6h': 'Tourism',
-                        "/g/120y8l81": "Enterprise"}
-
-            request = api_service.channels().list(
-                part="snippet,topicDetails,status",
-                id=channel_url.split('/')[-1]
-            )
-            response = request.execute()
-
-            # Check if the response has items
-            if 'items' in response:
-                channel_properties = response['items'][0]
-                made_for_kids = channel_properties.get('status', {}).get('madeForKids', 'No data')
-                description = channel_properties.get('snippet', {}).get('description', 'No data')
-                topic = channel_properties.get('topicDetails', {}).get('topicIds', 'No data')
-
-                if topic != 'No data':
-                    topic = ", ".join([topic_id[x] for x in reversed(topic)])
-
-                return channel_url, made_for_kids, description, topic
-
-            else:
-                return channel_url, 'No data', 'No data', 'No data'
+        if self.stop_and_save_state.is_set():
+            # user clicked the button, save without waiting for the worker
+            self.save_results("Process stopped: Result saved in your file")
+            return
 
-        # Initialize Language Detection
-        l_detector = LanguageDetectorBuilder.from_all_languages().with_preloaded_language_models().build()
+        while True:
+            try:
+                event, value = self.progress_queue.get_nowait()
+            except queue.Empty:
+                break
 
-        # Initialize calculation process time
-        start = time.time()
-        current_iteration = 0
-        max_iteration = self.channel_number
+            if event == "invalid":
+                self.cancel_process(f"Token invalid: n°{', '.join(map(str, value))}")
+                return
+            elif event == "quota":
+                self.save_results("Quota exceeded: Result saved in your file")
+                return
+            elif event == "done":
+                self.save_results("Process done: Result saved in your file")
+                return
+            elif event == "retry":
+                self.save_results("Process done: Result saved in your file\n"
+                                  "Some channels failed temporarily, upload your file again to process them")
+                return
+            elif event == "error":
+                self.save_results(f"Process interrupted ({value}): Result saved in your file")
+                return
+
+            count, kind = value
+            self.processed_iteration += count
+            self.throughput_estimator.add(count, kind)
+
+        self.charging_bar["value"] = self.processed_iteration
+
+        if time.monotonic() - self.last_eta_update >= ETA_UPDATE_INTERVAL / 1000:
+            # update the time left, the throughput and the quota at a fixed rate whatever the size of the blocks
+            self.last_eta_update = time.monotonic()
+            self.throughput_estimator.sample()
+            time_left = format_time_left(self.throughput_estimator.time_left())
+            channels_per_second = self.throughput_estimator.channels_per_second or 0
+            projected_quota = self.throughput_estimator.projected_quota()
+            self.lbl_yb_channel_count.config(text=f"{time_left} - {channels_per_second:.1f} channels/s\n"
+                                                  f"{'?' if projected_quota is None else projected_quota} quota needed"
+                                                  f" - {self.quota_scheduler.remaining()} left")
+            self.update_stats()
+
+        self.after(PROGRESS_POLL_INTERVAL, self.check_progress)
+
+    def update_stats(self):
+        """Display the durations of the stages and the counters of the process in the Stats tab"""
+        summary = self.run_metrics.summary()
+        lines = [f"{'stage':<15}{'count':>7}{'total s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"]
+        for stage, values in summary["stages"].items():
+            lines.append(f"{stage:<15}{values['count']:>7}{values['total']:>10.1f}{values['p50'] * 1000:>9.0f}"
+                         f"{values['p95'] * 1000:>9.0f}{values['p99'] * 1000:>9.0f}")
+        lines.append("")
+        lines.extend(f"{counter:<22}{value:>7}" for counter, value in summary["counters"].items())
+        lines.append(f"{'elapsed':<22}{round(summary['elapsed']):>6}s")
+        self.lbl_stats.config(text="\n".join(lines))
+
+    def export_report(self):
+        """Ask the user where to write the metrics of the process, as a json or csv file"""
+        filepath = filedialog.asksaveasfilename(defaultextension=".json", initialfile="run_report.json",
+                                                filetypes=[("JSON files", "*.json"), ("CSV files", "*.csv")])
+        if filepath:
+            self.run_metrics.save(filepath)
 
-        # Create a new worksheet or load the "Results" sheet
-        if "Results" in self.workbook.sheetnames:
-            result_sheet = self.workbook["Results"]
-        else:
-            result_sheet = self.workbook.create_sheet(title="Results")
-            result_sheet.append(["Placement", "Placement URL", "madeForKids", "Description", "Default Language", "Topic"])
+    def save_results(self, message):
+        """Save collected data in file in a background worker, the interface stays responsive while large files are
+        written and check_saved informs the user once they are saved
 
-        # Set the variable for future and get the channels already processed if any
-        channels_to_process = {k: v for k, v in self.channel.items() if k not in self.processed_channel}
+        Parameters
+        ----------
+        message : str
+            text displayed in the message box once the file is saved
+        """
+        # stop the worker if it is still running
+        self.stop_and_save_state.set()
+        # load charging bar to max and hide it
+        self.charging_bar["value"] = self.channel_number
+        self.charging_bar.hide_bar()
+        # the process can't be stopped twice while the files are saved
+        self.btn_process.config(state=tk.DISABLED)
+        self.lbl_yb_channel_count.config(text="Saving results")
+        threading.Thread(target=self.save_worker,
+                         args=(self.results_file, message, self.run_metrics, self.progress_queue),
+                         daemon=True).start()
+        self.after(PROGRESS_POLL_INTERVAL, self.check_saved)
 
-        # Initialize YouTube API service
-        youtube_api_service = get_youtube_api_service(self.api_entry.get())
+    def save_worker(self, results_file, message, metrics, progress_queue):
+        """Save the files and build their exclusion lists, then send ("saved", message) to the interface
 
-        # Set the total steps of the charging bar
-        self.charging_bar['maximum'] = self.channel_number
+        Runs in a background thread and never touches the widgets.
 
-        for element in channels_to_process:
-            channel_name = channels_to_process[element]
-            channel_url = element
+        Parameters
+        ----------
+        results_file : SharedResultsFile
+            files of the process
+        message : str
+            text displayed in the message box, completed with the exclusion lists built
+        metrics : RunMetrics
+            metrics of the process
+        progress_queue : queue.Queue
+            queue of the process read by the interface
+        """
+        try:
+            # save collected data in file, once the checking worker has written its last rows
+            with self.workbook_lock, metrics.measure("save"):
+                results_file.save()
+        except Exception as e:
+            print(f"Error saving the results: {str(e)}")
+            progress_queue.put(("saved", f"Results not saved ({str(e)}), upload your file again to resume"))
+            return
+
+        for file in results_file.results_files:
+            file_name = file.path.split('/')[-1]
+            try:
+                # build the exclusion lists when the file has a Rules tab
+                with metrics.measure("exclusions"):
+                    excluded = build_exclusions(file.path)
+            except (ValueError, OSError) as e:
+                message += f"\n{file_name}: exclusion lists not built: {str(e)}"
+            else:
+                message += "".join(f"\n{file_name}: {count} channels excluded by {name}"
+                                   for name, count in excluded.items())
 
-            # increment by 1 the charging bar and update the iteration counter
-            time.sleep(0.05)
-            self.charging_bar["value"] = current_iteration
-            current_iteration += 1
+        progress_queue.put(("saved", message))
 
+    def check_saved(self):
+        """Inform the user and reset the app once the files are saved, called periodically from the Tk main loop"""
+        while True:
             try:
-                # get the properties of channel and append to result worksheet
-                col2, col3, col4, col6 = get_channel_properties(youtube_api_service, channel_url)
-
-                # Langauge detection
-                if col4 not in ["error", "No data"]:
-                    language = l_detector.detect_language_of(col4)
-                    if language:
-                        col5 = language.iso_code_639_3.name
-                    else:
-                        language = l_detector.detect_language_of(channel_name)
-                        if language:
-                            col5 = f'low_{language.iso_code_639_3.name}'
-                        else:
-                            col5 = "No Data"
-
-                else:
-                    col5 = "No Data"
-
-                result_sheet.append([channel_name, col2, col3, col4, col5, col6])
-                print(f"processing {channel_name} - {channel_url}")
-
-            except Exception as e:
-                # Handle quota exceeded error
-                if "quotaExceeded" in str(e):
-                    messagebox.showinfo(title="Message Box", message="Quota exceeded: Result saved in your file", icon='info')
-                    break  # Exit the loop
-
-                # append channel data to result worksheet with error if exception raised
-                result_sheet.append([channel_name, channel_url, "error", "error", "error", "error"])
-                print(f"Error processing {channel_name} - {channel_url}: {str(e)}")
-
-            if self.stop_and_save_state:
-                # check state of attribute, if user click the button, exit the loop
-                break
+                event, value = self.progress_queue.get_nowait()
+            except queue.Empty:
+                self.after(PROGRESS_POLL_INTERVAL, self.check_saved)
+                return
 
-            # update the time left and display it
-            process_time = calculation_process_time(start, current_iteration, max_iteration)
-            self.lbl_yb_channel_count.config(text=f"{process_time}")
-            # update the charging bar and rest it for next iteration
-            self.charging_bar.update()
-            self.charging_bar["value"] = 0
+            # the progress sent by the checking worker before it stopped is ignored
+            if event == "saved":
+                break
 
-        # end of for loop
-        # load charging bar to max and hide it
-        self.charging_bar["value"] = self.channel_number
-        self.charging_bar.hide_bar()
-        # save collected data in file
-        self.workbook.save(self.excel_file_path.get())
+        self.update_stats()
         # display with message box process done
-        messagebox.showinfo(title="Message Box", message="Process done: Result saved in your file", icon='info')
+        messagebox.showinfo(title="Message Box", message=value, icon='info')
         # reset app for new process
         self.end_process()
 
+    def cancel_process(self, message):
+        """Inform the user the process couldn't start and give the interface back, the files stay uploaded
+
+        Parameters
+        ----------
+        message : str
+            text displayed in the message box
+        """
+        messagebox.showinfo(title="Message Box", message=message, icon='error')
+        self.charging_bar.hide_bar()
+        self.btn_process.config(text="Process channels", command=self.process_channels, state=tk.NORMAL)
+        self.lbl_yb_channel_count.config(text=f'{self.channel_number} channels\n{self.unique_channel_number} unique')
+        self.quota_scheduler = None
+        # the worker has returned, a new event and queue are enough for the next process
+        self.stop_and_save_state = threading.Event()
+        self.progress_queue = queue.Queue()
+        self.enable_settings()
+
+    def enable_settings(self):
+        """Enable the settings and the upload button disabled during the process"""
+        self.api_entry.config(state=tk.NORMAL)
+        self.spn_workers.config(state=tk.NORMAL)
+        self.chk_cache.config(state=tk.NORMAL)
+        self.spn_cache_ttl.config(state=tk.NORMAL)
+        self.languages_entry.config(state=tk.NORMAL)
+        self.chk_low_accuracy.config(state=tk.NORMAL)
+        for chk_column in self.chk_columns:
+            chk_column.config(state=tk.NORMAL)
+        self.chk_refresh.config(state=tk.NORMAL)
+        self.spn_refresh_days.config(state=tk.NORMAL)
+        self.btn_upload.config(state=tk.NORMAL)
+
     def end_process(self):
         """reset attribute and interface for potential new process cycle"""
         self.lbl_yb_channel_count.config(text="")
         self.btn_process.config(text=f"Process channels", command=self.process_channels, state=tk.DISABLED)
         self.channel_number = 0
+        self.unique_channel_number = 0
         self.processed_channel_number = 0
-        self.workbook = None
-        self.stop_and_save_state = False
+        self.excel_file_paths = []
+        self.results_file = None
+        self.quota_scheduler = None
+        # new event and queue so a worker still waiting for a request can't interfere with the next process
+        self.stop_and_save_state = threading.Event()
+        self.progress_queue = queue.Queue()
         self.lbl_file_uploaded.config(text="No file uploaded", image="", anchor=tk.CENTER)
-        self.api_entry.config(state=tk.NORMAL)
-        self.btn_upload.config(state=tk.NORMAL)
+        self.enable_settings()
 
 
 class Container(ttk.Frame):
@@ -547,7 +844,6 @@ class ChargingBar(ttk.Progressbar):
         """Hide the progress bar from the app interface"""
         self.grid_forget()
 
-
 if __name__ == "__main__":
     main_app = MainApp()
     main_app.mainloop()
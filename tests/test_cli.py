@@ -0,0 +1,17 @@
+import os
+
+from cli import get_output_path
+
+
+def test_get_output_path(tmp_path):
+    output = str(tmp_path / "out")
+    assert get_output_path("a/campaign.xlsx", None, False) == "a/campaign.xlsx"
+    assert get_output_path("a/campaign.xlsx", str(tmp_path / "results.xlsx"), False) == str(tmp_path / "results.xlsx")
+
+    first_path = get_output_path("a/campaign.xlsx", output, True)
+    assert first_path == os.path.join(output, "campaign.xlsx") and os.path.isdir(output)
+    # a file of another folder with the same name doesn't overwrite the first output
+    second_path = get_output_path("b/campaign.xlsx", output, True, [first_path])
+    assert second_path == os.path.join(output, "campaign_2.xlsx")
+    assert get_output_path("c/campaign.xlsx", output, True, [first_path, second_path]) == os.path.join(
+        output, "campaign_3.xlsx")
@@ -0,0 +1,245 @@
+import csv
+import json
+import types
+import sqlite3
+import datetime
+import httplib2
+import openpyxl
+import pytest
+
+import engine
+from googleapiclient.errors import HttpError
+from engine import (PARQUET_STATUS_COLUMN, RESULTS_HEADER, RESULTS_TABLE, CombinedResultsFile, CsvResultsFile,
+                    ParquetResultsFile, QuotaScheduler, ResultsFile, RetryPolicy, SqliteResultsFile,
+                    find_invalid_api_keys, get_column_positions, get_result_row, is_stale_result, load_channels,
+                    parse_channel_url)
+
+CHANNEL_ID = "UCuAXFkgsw1L7xaCfnd5JJOw"
+
+
+@pytest.mark.parametrize("channel_url, expected", [
+    (f"https://www.youtube.com/channel/{CHANNEL_ID}", ("id", CHANNEL_ID)),
+    (f"youtube.com/channel/{CHANNEL_ID}/videos", ("id", CHANNEL_ID)),
+    ("https://m.youtube.com/@handle?view=0", ("handle", "@handle")),
+    ("http://youtube.com/user/username", ("username", "username")),
+    ("www.youtube.com/c/custom", ("custom", "custom")),
+    ("https://www.youtube.com/custom/about", ("custom", "custom")),
+    ("youtube.com/Custom/videos?view=0", ("custom", "Custom")),
+    ("/@handle", ("handle", "@handle")),
+    (CHANNEL_ID, ("id", CHANNEL_ID)),
+])
+def test_parse_channel_url(channel_url, expected):
+    assert parse_channel_url(channel_url) == expected
+
+
+@pytest.mark.parametrize("channel_url", [
+    "https://www.example.com/news",
+    "example.com/@handle",
+    "https://youtu.be/abc",
+    "https://music.youtube.com/channel/" + CHANNEL_ID,
+    "mobileapp::2-com.example.app",
+    "https://www.youtube.com/watch?v=abc",
+    "https://www.youtube.com/channel",
+    "https://www.youtube.com/",
+    "youtube.com/video/dQw4w9WgXcQ",
+    "https://www.youtube.com/video/abcdefghijk",
+    "https://www.youtube.com/hashtag/music",
+    "https://www.youtube.com/post/UgkxAbCdEf",
+    "https://www.youtube.com/clip/UgkxAbCdEf",
+    "https://www.youtube.com/v/dQw4w9WgXcQ",
+    "https://www.youtube.com/custom/playlist/PL123",
+])
+def test_parse_channel_url_not_channel(channel_url):
+    assert parse_channel_url(channel_url) is None
+
+
+def make_http_error(status, reason):
+    """Build the error raised by googleapiclient for an api error response"""
+    content = json.dumps({"error": {"code": status, "message": reason, "errors": [{"reason": reason}]}}).encode()
+    return HttpError(httplib2.Response({"status": status}), content)
+
+
+@pytest.mark.parametrize("status, reason, expected", [
+    (429, "", True),
+    (503, "backendError", True),
+    (403, "rateLimitExceeded", True),
+    (403, "forbidden", False),
+    (404, "notFound", False),
+])
+def test_is_transient(status, reason, expected):
+    assert RetryPolicy.is_transient(make_http_error(status, reason)) is expected
+
+
+def test_find_invalid_api_keys(monkeypatch):
+    # answer of the api to the verification request of each token
+    errors = {"valid": None, "used": make_http_error(403, "quotaExceeded"), "wrong": make_http_error(400, "keyInvalid")}
+
+    def execute(api_key):
+        if errors[api_key]:
+            raise errors[api_key]
+        return {"items": []}
+
+    def build(service_name, version, developerKey):
+        request = types.SimpleNamespace(execute=lambda: execute(developerKey))
+        return types.SimpleNamespace(videos=lambda: types.SimpleNamespace(list=lambda **kwargs: request))
+
+    monkeypatch.setattr(engine, "build", build)
+    quota_scheduler = QuotaScheduler(["used", "valid"])
+
+    assert find_invalid_api_keys(["used", "valid"], quota_scheduler) == []
+    # the token out of quota is left aside for the run
+    assert quota_scheduler.current_key() == "valid"
+    assert find_invalid_api_keys(["valid", "wrong", "used"]) == [2]
+
+
+def test_is_stale_result():
+    columns = get_column_positions(RESULTS_HEADER)
+    limit = datetime.datetime(2026, 1, 1)
+    row = get_result_row("name", "url", False, "description", "ENG", "Pop music")
+
+    assert not is_stale_result(row, limit, columns)
+    assert is_stale_result(row, datetime.datetime.now() + datetime.timedelta(days=1), columns)
+    assert is_stale_result(["name", "url", "error"] + row[3:], limit, columns)
+    # the rows of earlier versions have no time of check
+    assert is_stale_result(row[:6], limit, get_column_positions(RESULTS_HEADER[:6]))
+
+
+def test_results_file_with_other_categories(tmp_path):
+    # the results of a file written when topics.json had other categories
+    path = str(tmp_path / "results.xlsx")
+    header = RESULTS_HEADER[:6] + ["Video games", "Checked at"]
+    workbook = openpyxl.Workbook()
+    workbook.active.title = "Data"
+    workbook["Data"].append(["Placement", "Placement URL"])
+    workbook["Data"].append(["old", "https://www.youtube.com/@old"])
+    workbook["Data"].append(["new", "https://www.youtube.com/@new"])
+    workbook.create_sheet("Results").append(header)
+    workbook["Results"].append(["old", "https://www.youtube.com/@old", False, "d", "ENG", "Gaming", True,
+                                datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")])
+    workbook.save(path)
+
+    channels, processed_channels = load_channels(path, refresh_days=30)
+    assert processed_channels == {"https://www.youtube.com/@old"}
+
+    results_file = ResultsFile(path)
+    results_file.append([get_result_row("new", "https://www.youtube.com/@new", True, "d", "ENG", "Pop music")])
+    results_file.save()
+
+    rows = list(openpyxl.load_workbook(path)["Results"].iter_rows(values_only=True))
+    assert list(rows[0]) == RESULTS_HEADER + ["Video games"]
+    old_row = dict(zip(rows[0], rows[1]))
+    assert old_row["Topic"] == "Gaming" and old_row["Video games"] is True and old_row["Checked at"] is not None
+    new_row = dict(zip(rows[0], rows[2]))
+    assert new_row["Placement URL"] == "https://www.youtube.com/@new" and new_row["Music"] is True
+
+
+def test_results_file_keeps_formatting(tmp_path):
+    path = str(tmp_path / "results.xlsx")
+    workbook = openpyxl.Workbook()
+    workbook.active.title = "Data"
+    workbook["Data"].append(["Placement", "Placement URL"])
+    workbook["Data"].append(["new", "https://www.youtube.com/@new"])
+    workbook["Data"]["A1"].font = openpyxl.styles.Font(bold=True)
+    workbook["Data"]["B2"].hyperlink = "https://www.youtube.com/@new"
+    workbook["Data"].column_dimensions["B"].width = 50
+    workbook.create_sheet("Budget")["A1"] = 1234.5
+    workbook["Budget"]["A1"].number_format = "#,##0.00"
+    workbook.save(path)
+
+    results_file = ResultsFile(path)
+    results_file.append([get_result_row("new", "https://www.youtube.com/@new", True, " text\x01 ", "ENG", "")])
+    results_file.save()
+
+    workbook = openpyxl.load_workbook(path)
+    assert workbook.sheetnames == ["Data", "Budget", "Results"]
+    assert workbook["Data"]["A1"].font.b and workbook["Data"].column_dimensions["B"].width == 50
+    assert workbook["Data"]["B2"].hyperlink.target == "https://www.youtube.com/@new"
+    assert workbook["Budget"]["A1"].number_format == "#,##0.00"
+    rows = list(workbook["Results"].iter_rows(values_only=True))
+    assert list(rows[0]) == RESULTS_HEADER
+    assert rows[1][:4] == ("new", "https://www.youtube.com/@new", True, " text ")
+
+
+ROWS = [get_result_row("kids", "https://www.youtube.com/@kids", True, "d", "ENG", "Pop music"),
+        get_result_row("unknown", "https://www.youtube.com/@unknown", "No data", "", "No Data", "")]
+
+
+def test_csv_results_file(tmp_path):
+    path = str(tmp_path / "results.csv")
+    for rows in (ROWS[:1], ROWS[1:]):
+        # a later run appends its rows without a second header
+        results_file = CsvResultsFile(path)
+        results_file.append(rows)
+        results_file.save()
+        results_file.close()
+
+    with open(path, newline="", encoding="utf-8") as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == RESULTS_HEADER and len(rows) == 3
+    assert rows[1][:3] == ["kids", "https://www.youtube.com/@kids", "True"] and rows[2][2] == "No data"
+
+
+def test_csv_results_file_other_header(tmp_path):
+    # a file written when topics.json had other categories
+    path = tmp_path / "results.csv"
+    path.write_text(",".join(RESULTS_HEADER[:6] + ["Video games", "Checked at"]) + "\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="results.csv has other columns"):
+        CsvResultsFile(str(path))
+
+
+def test_sqlite_results_file(tmp_path):
+    path = str(tmp_path / "results.db")
+    SqliteResultsFile(path).append(ROWS)
+    # a url checked again by a later run replaces its row
+    SqliteResultsFile(path).append([get_result_row("kids", "https://www.youtube.com/@kids", False, "d", "FRA", "")])
+
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute(f'SELECT "Placement URL", madeForKids, "Default Language" FROM {RESULTS_TABLE} '
+                                  f'ORDER BY "Placement URL"').fetchall()
+    assert rows == [("https://www.youtube.com/@kids", 0, "FRA"),
+                    ("https://www.youtube.com/@unknown", "No data", "No Data")]
+
+
+def test_sqlite_results_file_earlier_duplicates(tmp_path):
+    # a table of an earlier version, without unique urls nor the categories
+    path = str(tmp_path / "results.db")
+    with sqlite3.connect(path) as connection:
+        connection.execute(f'CREATE TABLE {RESULTS_TABLE} ("Placement", "Placement URL", "madeForKids")')
+        connection.executemany(f"INSERT INTO {RESULTS_TABLE} VALUES (?, ?, ?)",
+                               [("a", "url", "error"), ("a", "url", True)])
+    SqliteResultsFile(path)
+
+    with sqlite3.connect(path) as connection:
+        assert connection.execute(f'SELECT madeForKids, "Checked at" FROM {RESULTS_TABLE}').fetchall() == [(1, None)]
+
+
+def test_parquet_results_file(tmp_path):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    results_file = ParquetResultsFile(str(tmp_path / "results"))
+    results_file.append(ROWS)
+    results_file.checkpoint()
+    results_file.append([get_result_row("error", "https://www.youtube.com/@error", "error", "error", "error", "")])
+    results_file.close()
+
+    table = pyarrow_parquet.read_table(results_file.path)
+    assert str(table.schema.field("madeForKids").type) == "bool"
+    assert str(table.schema.field("Music").type) == "bool"
+    assert table.column_names.index(PARQUET_STATUS_COLUMN) == table.column_names.index("madeForKids") + 1
+    assert table.column("madeForKids").to_pylist() == [True, None, None]
+    assert table.column(PARQUET_STATUS_COLUMN).to_pylist() == [None, "No data", "error"]
+    assert table.column("Music").to_pylist() == [True, False, False]
+
+
+def test_combined_results_file(tmp_path):
+    csv_file = CsvResultsFile(str(tmp_path / "results.csv"))
+    sqlite_file = SqliteResultsFile(str(tmp_path / "results.db"))
+    results_file = CombinedResultsFile([csv_file, sqlite_file])
+    results_file.append(ROWS)
+    results_file.checkpoint()
+    results_file.save()
+    csv_file.close()
+
+    with open(csv_file.path, newline="", encoding="utf-8") as file:
+        assert len(list(csv.reader(file))) == 3
+    with sqlite3.connect(sqlite_file.path) as connection:
+        assert connection.execute(f"SELECT COUNT(*) FROM {RESULTS_TABLE}").fetchone() == (2,)
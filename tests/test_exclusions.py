@@ -0,0 +1,113 @@
+import json
+import openpyxl
+import pytest
+
+from engine import RESULTS_HEADER, get_result_row
+from exclusions import (EXCLUSIONS_HEADER, RuleSet, build_exclusions, get_category_column, load_rule_sets,
+                        parse_rule_sets)
+
+
+def make_results(rows):
+    """Get the columns of the Results tab {header: values} of result rows"""
+    return {name: list(values) for name, values in zip(RESULTS_HEADER, zip(*rows))}
+
+
+RESULTS = make_results([
+    get_result_row("kids", "https://www.youtube.com/@kids", True, "d", "ENG", "Pop music"),
+    get_result_row("game", "https://www.youtube.com/@game", False, "d", "low_FRA", "Casual game"),
+    get_result_row("french", "https://www.youtube.com/@french", False, "d", "FRA", "Humor"),
+    get_result_row("unknown", "https://www.youtube.com/@unknown", "No data", "", "No Data", ""),
+    get_result_row("error", "https://www.youtube.com/@error", "error", "error", "error", "error"),
+])
+
+
+def test_find_exclusions_made_for_kids():
+    exclusions = RuleSet("A", made_for_kids=True).find_exclusions(RESULTS)
+    # the 'No data' and 'error' statuses are not made for kids
+    assert exclusions == [["kids", "https://www.youtube.com/@kids", "madeForKids"]]
+
+
+def test_find_exclusions_blocked_category():
+    exclusions = RuleSet("A", blocked_categories=[" gaming", "Music"]).find_exclusions(RESULTS)
+    assert exclusions == [["kids", "https://www.youtube.com/@kids", "Music"],
+                          ["game", "https://www.youtube.com/@game", "Gaming"]]
+
+
+def test_find_exclusions_allowed_language():
+    exclusions = RuleSet("A", allowed_languages=["eng"]).find_exclusions(RESULTS)
+    # the languages found with low confidence count, the unknown languages are not excluded
+    assert exclusions == [["game", "https://www.youtube.com/@game", "Language"],
+                          ["french", "https://www.youtube.com/@french", "Language"]]
+
+
+def test_find_exclusions_reasons():
+    rule_set = RuleSet("A", made_for_kids=True, blocked_categories=["Music"], allowed_languages=["FRA"])
+    assert rule_set.find_exclusions(RESULTS)[0] == ["kids", "https://www.youtube.com/@kids",
+                                                    "madeForKids, Music, Language"]
+    assert RuleSet("A").find_exclusions(RESULTS) == []
+
+
+def test_get_category_column_earlier_versions():
+    # rows of earlier versions have the topic but no category columns
+    results = {"Topic": ["Pop music, Casual game", "Humor", None, "error"]}
+    assert get_category_column(results, "Gaming") == [True, False, False, False]
+    results["Gaming"] = [False, None, None, None]
+    assert get_category_column(results, "Gaming") == [False, False, False, False]
+
+
+@pytest.mark.parametrize("rule_set, message", [
+    ({"blocked_categories": ["Cooking"]}, "A: unknown category Cooking"),
+    ({"allowed_languages": ["XYZ"]}, "A: unknown language code XYZ"),
+])
+def test_rule_set_errors(rule_set, message):
+    with pytest.raises(ValueError, match=message):
+        RuleSet("A", **rule_set)
+
+
+def test_parse_rule_sets():
+    rule_sets = parse_rule_sets([
+        ("Client A", "Exclude madeForKids", "TRUE"),
+        ("Client A", "Blocked category", "Gaming"),
+        ("Client B", "Allowed language", "ENG"),
+        ("Client B", "Allowed language", "FRA"),
+        ("Client B", None, None),
+        (None, "Exclude madeForKids", True),
+    ])
+    assert [rule_set.name for rule_set in rule_sets] == ["Client A", "Client B", "Exclusions"]
+    assert rule_sets[0].made_for_kids and rule_sets[0].blocked_categories == ["Gaming"]
+    assert not rule_sets[1].made_for_kids and rule_sets[1].allowed_languages == {"ENG", "FRA"}
+    assert rule_sets[2].made_for_kids
+
+    with pytest.raises(ValueError, match="Unknown rule: Blocked topic"):
+        parse_rule_sets([("Client A", "Blocked topic", "Gaming")])
+
+
+def test_load_rule_sets_json(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"Client A": {"made_for_kids": True, "blocked_categories": ["Gaming"]}}))
+    rule_sets = load_rule_sets(str(path))
+    assert rule_sets[0].name == "Client A" and rule_sets[0].blocked_categories == ["Gaming"]
+
+    path.write_text(json.dumps({"Client A": {"blocked_topics": ["Gaming"]}}))
+    with pytest.raises(ValueError, match="Unknown rule in rules.json"):
+        load_rule_sets(str(path))
+
+
+def test_build_exclusions(tmp_path):
+    path = str(tmp_path / "results.xlsx")
+    workbook = openpyxl.Workbook()
+    workbook.active.title = "Data"
+    workbook.create_sheet("Results").append(RESULTS_HEADER)
+    for row in zip(*RESULTS.values()):
+        workbook["Results"].append(row)
+    workbook.create_sheet("Rules").append(["Rule set", "Rule", "Value"])
+    workbook["Rules"].append(["Client A", "Exclude madeForKids", "TRUE"])
+    workbook.save(path)
+
+    assert load_rule_sets(path)[0].made_for_kids
+    assert build_exclusions(path, csv_directory=str(tmp_path)) == {"Client A": 1}
+
+    rows = list(openpyxl.load_workbook(path)["Exclusions"].iter_rows(values_only=True))
+    assert rows == [tuple(EXCLUSIONS_HEADER), ("Client A", "kids", "https://www.youtube.com/@kids", "madeForKids")]
+    csv_rows = (tmp_path / "results_Client_A.csv").read_text().splitlines()
+    assert csv_rows == ["Placement", "https://www.youtube.com/@kids"]